@@ -1,366 +1,656 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify, url_for
 from flask_cors import CORS
 import cv2
-import pytesseract
 import numpy as np
 from PIL import Image
 import io
+import json
 import re
-from datetime import datetime
+import sqlite3
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import os
 from werkzeug.utils import secure_filename
 
-app = Flask(__name__)
-CORS(app)
+from cache import DiskCache, ImageCache, LRUCache, ResultCache, content_hash, make_key
+from config import get_config, upload_path
+from debug_writer import DebugWriter
+from deadline import Deadline, DeadlineExceeded
+from extraction import extract_invoice_data
+from jobs import JobManager, QueueFullError
+from metrics import (
+    CACHE_LOOKUPS, IMAGE_PIXELS, PREPROCESS_PROFILES, PREPROCESS_STAGE_SECONDS, REGISTRY, REQUEST_SECONDS, REQUESTS,
+    TIMEOUTS, Timings,
+)
+from ocr_engine import OCREngine, OCR_CONFIGS, SEARCH_MODES
+from ocr_store import OCRStore
+from pdf import PDFError, is_pdf, iter_pages
+from preprocessing import decode, run_pipeline
 
-# Configuración
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+# Rutas de la API (create_app registra el blueprint)
+api = Blueprint('api', __name__)
 
-# Crear carpeta de uploads si no existe
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Servicios del proceso: se crean una sola vez en init_services, desde create_app
+settings = None
+UPLOAD_FOLDER = None
+ALLOWED_EXTENSIONS = None
+ocr_engine = None
+result_cache = None
+image_cache = None
+ocr_store = None
+job_manager = None
+batch_executor = None
+pdf_executor = None
+debug_writer = None
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def preprocess_image(image):
+def init_services(config):
     """
-    Preprocesa la imagen para mejorar el OCR
-    ENFOQUE RADICAL para facturas extremadamente problemáticas
+    Crea los servicios compartidos por todas las peticiones del proceso:
+    pool de OCR, cachés, almacén de OCR, cola de trabajos y executors
     """
-    # Paso 1: Upscaling OPTIMIZADO (4x para balance entre calidad y velocidad)
-    h, w = image.shape[:2]
-    upscaled = cv2.resize(image, (w*4, h*4), interpolation=cv2.INTER_CUBIC)
-    
-    # Paso 2: Convertir a escala de grises
-    gray = cv2.cvtColor(upscaled, cv2.COLOR_BGR2GRAY)
-    
-    # Paso 3: Corrección de rotación ULTRA-AGRESIVA
-    try:
-        # Detectar líneas con parámetros ultra-sensibles
-        edges = cv2.Canny(gray, 20, 80, apertureSize=3)
-        lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=30)
-        
-        if lines is not None:
-            angles = []
-            for line in lines:
-                rho, theta = line[0]
-                angle = theta * 180 / np.pi
-                # Considerar líneas en un rango MUY amplio
-                if -15 <= angle <= 15 or 165 <= angle <= 195:
-                    angles.append(angle)
-            
-            if angles:
-                avg_angle = np.mean(angles)
-                if abs(avg_angle) > 0.1:  # Umbral ULTRA bajo
-                    center = (w*4//2, h*4//2)
-                    rotation_matrix = cv2.getRotationMatrix2D(center, -avg_angle, 1.0)
-                    gray = cv2.warpAffine(gray, rotation_matrix, (w*4, h*4))
-    except:
-        pass
-    
-    # Paso 4: ESTRATEGIA RADICAL de mejora de contraste
-    # Aplicar CLAHE múltiples veces con diferentes parámetros
-    clahe1 = cv2.createCLAHE(clipLimit=6.0, tileGridSize=(4,4))
-    enhanced1 = clahe1.apply(gray)
-    
-    clahe2 = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(12,12))
-    enhanced2 = clahe2.apply(gray)
-    
-    clahe3 = cv2.createCLAHE(clipLimit=8.0, tileGridSize=(6,6))
-    enhanced3 = clahe3.apply(gray)
-    
-    # Normalización de histograma
-    enhanced4 = cv2.equalizeHist(gray)
-    
-    # Combinar TODAS las estrategias
-    temp = cv2.addWeighted(enhanced1, 0.4, enhanced2, 0.3, 0)
-    temp = cv2.addWeighted(temp, 0.7, enhanced3, 0.2, 0)
-    enhanced = cv2.addWeighted(temp, 0.8, enhanced4, 0.1, 0)
-    
-    # Paso 5: Filtros de ruido ULTRA-AGRESIVOS
-    # Aplicar filtros múltiples veces
-    enhanced = cv2.bilateralFilter(enhanced, 15, 80, 80)
-    enhanced = cv2.medianBlur(enhanced, 5)
-    enhanced = cv2.bilateralFilter(enhanced, 9, 60, 60)
-    
-    # Paso 6: Sharpening EXTREMO
-    kernel_sharpen = np.array([[-1,-1,-1,-1,-1,-1,-1],
-                                [-1, 1, 1, 1, 1, 1,-1],
-                                [-1, 1, 2, 2, 2, 1,-1],
-                                [-1, 1, 2, 8, 2, 1,-1],
-                                [-1, 1, 2, 2, 2, 1,-1],
-                                [-1, 1, 1, 1, 1, 1,-1],
-                                [-1,-1,-1,-1,-1,-1,-1]]) / 8.0
-    sharpened = cv2.filter2D(enhanced, -1, kernel_sharpen)
-    
-    # Paso 7: Múltiples métodos de thresholding RADICALES
-    # Método 1: Otsu
-    _, thresh1 = cv2.threshold(sharpened, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    
-    # Método 2: Adaptativo ultra-agresivo
-    thresh2 = cv2.adaptiveThreshold(
-        sharpened, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        7,   # Tamaño de bloque MUY pequeño
-        1    # Constante C mínima
+    global settings, UPLOAD_FOLDER, ALLOWED_EXTENSIONS, ocr_engine, result_cache, image_cache
+    global ocr_store, job_manager, batch_executor, pdf_executor, debug_writer
+    
+    settings = config
+    
+    # Configuración
+    UPLOAD_FOLDER = settings['UPLOAD_FOLDER']
+    ALLOWED_EXTENSIONS = settings['ALLOWED_EXTENSIONS']
+    
+    # Pool de workers compartido para el barrido de configuraciones de OCR
+    ocr_engine = OCREngine(
+        max_workers=settings['OCR_MAX_WORKERS'],
+        config_timeout=settings['OCR_CONFIG_TIMEOUT'],
+        search_mode=settings['OCR_SEARCH_MODE'],
+        score_threshold=settings['OCR_SCORE_THRESHOLD'],
+        patience=settings['OCR_ADAPTIVE_PATIENCE'],
+        adaptive_batch=settings['OCR_ADAPTIVE_BATCH'],
+        stats_path=upload_path(UPLOAD_FOLDER, settings['OCR_STATS_FILE']),
+        backend=settings['OCR_BACKEND']
     )
     
-    # Método 3: Adaptativo por media
-    thresh3 = cv2.adaptiveThreshold(
-        sharpened, 255,
-        cv2.ADAPTIVE_THRESH_MEAN_C,
-        cv2.THRESH_BINARY,
-        11,
-        2
+    # Crear carpeta de uploads si no existe
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    
+    # Caché de resultados por contenido y de imágenes preprocesadas
+    if settings['CACHE_ENABLED']:
+        result_cache = ResultCache(
+            LRUCache(settings['CACHE_MAX_ENTRIES'], settings['CACHE_MAX_BYTES'], settings['CACHE_TTL']),
+            DiskCache(
+                upload_path(UPLOAD_FOLDER, settings['CACHE_DISK_PATH']),
+                ttl=settings['CACHE_DISK_TTL'],
+                max_entries=settings['CACHE_DISK_MAX_ENTRIES']
+            ) if settings['CACHE_DISK_ENABLED'] else None
+        )
+        image_cache = ImageCache(
+            settings['PREPROCESS_CACHE_MAX_ENTRIES'],
+            settings['PREPROCESS_CACHE_MAX_BYTES'],
+            settings['CACHE_TTL']
+        )
+    
+    # Almacén del OCR para re-extraer campos sin repetir el OCR (reextract.py)
+    ocr_store = OCRStore(upload_path(UPLOAD_FOLDER, settings['OCR_STORE_PATH'])) if settings['OCR_STORE_ENABLED'] else None
+    
+    # Cola de trabajos asíncronos (se procesan con el mismo pipeline); vive en
+    # sqlite para que cualquier worker de gunicorn responda a las consultas
+    job_manager = JobManager(
+        run_invoice_pipeline,
+        upload_path(UPLOAD_FOLDER, settings['JOB_STORE_PATH']),
+        workers=settings['JOB_WORKERS'],
+        max_queue=settings['JOB_QUEUE_SIZE'],
+        result_ttl=settings['JOB_RESULT_TTL']
     )
     
-    # Método 4: Threshold manual ultra-agresivo
-    p10 = np.percentile(sharpened, 10)
-    p90 = np.percentile(sharpened, 90)
-    threshold_val = (p10 + p90) / 2
-    _, thresh4 = cv2.threshold(sharpened, threshold_val, 255, cv2.THRESH_BINARY)
-    
-    # Método 5: Threshold muy bajo para capturar texto débil
-    _, thresh5 = cv2.threshold(sharpened, 100, 255, cv2.THRESH_BINARY)
-    
-    # Método 6: Threshold muy alto para texto fuerte
-    _, thresh6 = cv2.threshold(sharpened, 200, 255, cv2.THRESH_BINARY)
-    
-    # Combinar TODOS los métodos
-    # Usar Otsu como base y mejorar con otros
-    final = thresh1.copy()
-    
-    # Combinar con threshold adaptativo
-    final = cv2.bitwise_and(final, thresh2)
-    
-    # Paso 8: Operaciones morfológicas ULTRA-AGRESIVAS
-    # Cerrar huecos en letras
-    kernel_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (4, 4))
-    closed = cv2.morphologyEx(final, cv2.MORPH_CLOSE, kernel_close)
+    # Workers compartidos por los lotes de /api/process-invoices/batch
+    batch_executor = ThreadPoolExecutor(max_workers=settings['BATCH_WORKERS'], thread_name_prefix='batch')
     
-    # Eliminar ruido pequeño
-    kernel_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-    opened = cv2.morphologyEx(closed, cv2.MORPH_OPEN, kernel_open)
+    # Workers para el OCR de las páginas escaneadas de los PDF
+    pdf_executor = ThreadPoolExecutor(max_workers=settings['PDF_PAGE_WORKERS'], thread_name_prefix='pdf-page')
     
-    # Dilatar para fortalecer texto
-    kernel_dilate = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    final = cv2.dilate(opened, kernel_dilate, iterations=2)
+    # Imágenes preprocesadas de depuración (a petición o por muestreo, fuera del hilo de la petición)
+    debug_writer = DebugWriter(
+        upload_path(UPLOAD_FOLDER, settings['DEBUG_IMAGES_DIR']),
+        sample_rate=settings['DEBUG_IMAGES_SAMPLE_RATE'],
+        max_queue=settings['DEBUG_IMAGES_QUEUE_SIZE'],
+        max_files=settings['DEBUG_IMAGES_MAX_FILES'],
+        max_bytes=settings['DEBUG_IMAGES_MAX_BYTES']
+    )
+
+def create_app(config_name=None):
+    """
+    Crea la aplicación Flask con la configuración del entorno (FLASK_ENV)
+    Los servicios son del proceso: solo la primera llamada los crea
+    """
+    app = Flask(__name__)
+    app.config.from_object(get_config(config_name or os.environ.get('FLASK_ENV', 'default')))
+    CORS(app)
     
-    # Erosión final para limpiar
-    kernel_erode = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
-    final = cv2.erode(final, kernel_erode, iterations=1)
+    if ocr_engine is None:
+        init_services(app.config)
     
-    return final
+    app.register_blueprint(api)
+    return app
 
-def extract_invoice_data(text):
+def warmup():
     """
-    Extrae datos estructurados de la factura
-    Similar a Amazon Textract pero personalizado para facturas españolas
+    Carga OpenCV y el modelo de Tesseract en los workers de OCR antes de
+    aceptar tráfico, para que la primera factura no pague la inicialización
     """
-    data = {
-        'raw_text': text,
-        'invoice_number': None,
-        'date': None,
-        'total_amount': None,
-        'currency': 'COP',  # Por defecto pesos colombianos
-        'subtotal': None,
-        'tax': None,
-        'nif_cif': None,
-        'vendor_name': None,
-        'client_name': None,
-        'email': None,
-        'items': [],
-        'confidence': 0
+    start = time.perf_counter()
+    image = np.full((120, 480, 3), 255, np.uint8)
+    cv2.putText(image, 'FACTURA 123', (10, 80), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 3)
+    processed_image, _ = run_pipeline(image, settings['PREPROCESSING_PROFILE'], params=preprocessing_params())
+    ocr_engine.warmup(processed_image)
+    print(f"🔥 Precalentamiento completado en {(time.perf_counter() - start) * 1000:.0f} ms")
+
+class InvalidImageError(Exception):
+    """El archivo subido no se pudo decodificar como imagen"""
+
+def request_flag(name):
+    """Lee un campo booleano del formulario o de la query ('1', 'true', 'yes', 'on')"""
+    return request.values.get(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def save_debug_image(image, debug=False, label=None):
+    """Encola la imagen preprocesada para guardarla si se pidió o toca por muestreo"""
+    if debug_writer is not None and debug_writer.wanted(debug):
+        path = debug_writer.submit(image, label)
+        if path:
+            print(f"🔍 Imagen procesada en cola para guardar: {path}")
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def preprocessing_params():
+    """Parámetros de las etapas de preprocesamiento definidos en la configuración"""
+    return {
+        'upscale': {
+            'target_text_height': settings['PREPROCESSING_TARGET_TEXT_HEIGHT'],
+            'max_pixels': settings['PREPROCESSING_MAX_PIXELS'],
+        }
     }
+
+def decode_image(image_bytes):
+    """
+    Decodifica los bytes subidos en gris, reducidos si la imagen es muy grande
+    y con la orientación EXIF aplicada; devuelve la imagen y la información
+    de la decodificación (tamaño original, reducción, DPI)
+    """
+    if is_pdf(image_bytes):
+        raise InvalidImageError('Los PDF solo se admiten en /api/process-invoice')
+    image, decode_info = decode(image_bytes, min_pixels=settings['PREPROCESSING_DECODE_MIN_PIXELS'])
+    if image is None:
+        raise InvalidImageError('No se pudo leer la imagen')
+    return image, decode_info
+
+def pipeline_signature():
+    """Lo que, además del archivo, determina el resultado (parte de las claves de caché)"""
+    return make_key(
+        settings['PIPELINE_VERSION'],
+        settings['PREPROCESSING_PROFILE'],
+        settings['PREPROCESSING_DOCUMENT_CROP'],
+        settings['PREPROCESSING_ORIENTATION'],
+        settings['PREPROCESSING_DECODE_MIN_PIXELS'],
+        json.dumps(preprocessing_params(), sort_keys=True)
+    )
+
+def preprocess(image, dpi=None, deadline=None, timings=None):
+    """Ejecuta el perfil de preprocesamiento configurado y registra sus métricas"""
+    timings = timings or Timings()
+    IMAGE_PIXELS.observe(image.shape[0] * image.shape[1], phase='source')
+    try:
+        with timings.stage('preprocess'):
+            processed_image, preprocessing_info = run_pipeline(
+                image, settings['PREPROCESSING_PROFILE'], dpi=dpi, params=preprocessing_params(), deadline=deadline,
+                document=settings['PREPROCESSING_DOCUMENT_CROP'], orientation=settings['PREPROCESSING_ORIENTATION']
+            )
+    except DeadlineExceeded:
+        TIMEOUTS.inc(stage='preprocess')
+        raise
+    
+    IMAGE_PIXELS.observe(processed_image.shape[0] * processed_image.shape[1], phase='preprocessed')
+    PREPROCESS_PROFILES.inc(profile=preprocessing_info['profile'])
+    for stage, ms in preprocessing_info['timings_ms'].items():
+        PREPROCESS_STAGE_SECONDS.observe(ms / 1000, profile=preprocessing_info['profile'], stage=stage)
+    return processed_image, preprocessing_info
+
+def page_rotation(preprocessing_info):
+    """Giro (grados, sentido horario) aplicado para poner la página derecha"""
+    return (preprocessing_info.get('orientation') or {}).get('rotation', 0)
+
+def get_preprocessed_image(image_bytes, image_hash, deadline=None, timings=None):
+    """
+    Decodifica y preprocesa la imagen
+    El resultado se cachea por contenido y lo comparten ambos endpoints
+    """
+    timings = timings or Timings()
+    key = make_key(image_hash, 'preprocess', pipeline_signature())
+    
+    if image_cache is not None:
+        cached = image_cache.get(key)
+        CACHE_LOOKUPS.inc(cache='preprocessed_image', result='memory' if cached is not None else 'miss')
+        if cached is not None:
+            processed_image, preprocessing_info = cached
+            preprocessing_info['cache'] = 'hit'
+            print("♻️  Imagen preprocesada recuperada de la caché")
+            return processed_image, preprocessing_info
+    
+    with timings.stage('decode'):
+        image, decode_info = decode_image(image_bytes)
+    processed_image, preprocessing_info = preprocess(image, decode_info['dpi'], deadline, timings)
+    preprocessing_info['decode'] = decode_info
+    print(f"🧪 Preprocesamiento ({preprocessing_info['profile']}): {preprocessing_info['total_ms']:.0f} ms")
+    
+    if image_cache is not None:
+        image_cache.set(key, processed_image, preprocessing_info)
+        preprocessing_info = dict(preprocessing_info)
+    preprocessing_info['cache'] = 'miss'
+    return processed_image, preprocessing_info
+
+def cached_result(key, compute, timings=None):
+    """Devuelve el resultado cacheado para `key` o lo calcula y lo guarda"""
+    if result_cache is None:
+        return compute(), None
+    
+    timings = timings or Timings()
+    with timings.stage('cache_lookup'):
+        cached, tier = result_cache.get(key)
+    CACHE_LOOKUPS.inc(cache='result', result=tier or 'miss')
+    if cached is not None:
+        print(f"♻️  Resultado recuperado de la caché ({tier})")
+        return cached, tier
+    
+    result = compute()
+    # Un resultado parcial (tiempo agotado) no se cachea
+    if not result.get('processing_info', {}).get('timed_out'):
+        result_cache.set(key, result)
+    return result, None
+
+def store_ocr_result(image_hash, text, ocr_data, ocr_config, ocr_score, invoice_data, filename):
+    """Guarda el OCR en el almacén; si falla la petición sigue adelante"""
+    if ocr_store is None:
+        return
+    try:
+        ocr_store.save(
+            image_hash, settings['PIPELINE_VERSION'], text, ocr_data,
+            ocr_config=ocr_config, ocr_score=ocr_score,
+            invoice_data=invoice_data, filename=filename
+        )
+    except sqlite3.Error as e:
+        print(f"⚠️  Error guardando el OCR en el almacén: {e}")
+
+def request_deadline():
+    """Presupuesto de tiempo de una factura (preprocesado + OCR)"""
+    return Deadline(settings['REQUEST_DEADLINE'])
+
+def processed_text_height(preprocessing_info):
+    """Altura de carácter en la imagen preprocesada (None si el reescalado no la estimó)"""
+    text_height = preprocessing_info.get('text_height_px')
+    if not text_height:
+        return None
+    return text_height * preprocessing_info.get('scale', 1.0)
+
+def ocr_best(processed_image, search_mode, deadline=None, timings=None, text_height=None):
+    """
+    OCR buscando la mejor configuración
+    (una sola pasada de Tesseract por configuración)
+    Si se agota el tiempo devuelve lo mejor encontrado hasta entonces
+    """
+    timings = timings or Timings()
+    with timings.stage('ocr'):
+        best = ocr_engine.search(processed_image, mode=search_mode, deadline=deadline, text_height=text_height)
+    
+    if best['text']:
+        text = best['text']
+        ocr_data = best['data']
+    elif best['timed_out']:
+        text, ocr_data = '', None
+    else:
+        try:
+            with timings.stage('ocr'):
+                text, ocr_data = ocr_engine.run(processed_image, OCR_CONFIGS[0], deadline, best['config_ms'])
+        except (DeadlineExceeded, RuntimeError):
+            if deadline is None or not deadline.expired():
+                raise
+            best['timed_out'] = True
+            text, ocr_data = '', None
+    if best['timed_out']:
+        TIMEOUTS.inc(stage='ocr')
+    print(f"✅ Mejor configuración: {best['config']}")
+    print(f"📊 Confianza final: {best['score']:.1f}")
+    print(f"🔁 Configuraciones probadas: {best['configs_tried']}")
+    print(f"📝 Texto extraído: {len(text)} caracteres")
+    return text, ocr_data, best
+
+def words_from_ocr_data(ocr_data, page=None):
+    """Palabras con coordenadas de la configuración ganadora (similar a Textract)"""
+    words_with_positions = []
+    if not ocr_data:
+        return words_with_positions
+    n_boxes = len(ocr_data['text'])
+    for i in range(n_boxes):
+        if int(ocr_data['conf'][i]) > 30:  # Solo palabras con confianza > 30%
+            word = {
+                'text': ocr_data['text'][i],
+                'confidence': float(ocr_data['conf'][i]),
+                'bounding_box': {
+                    'x': int(ocr_data['left'][i]),
+                    'y': int(ocr_data['top'][i]),
+                    'width': int(ocr_data['width'][i]),
+                    'height': int(ocr_data['height'][i])
+                }
+            }
+            if page is not None:
+                word['page'] = page
+            words_with_positions.append(word)
+    return words_with_positions
+
+def average_confidence(words):
+    return sum([w['confidence'] for w in words]) / len(words) if words else 0
+
+def run_invoice_pipeline(image_bytes, search_mode, filename=None, debug=False, include_timings=False):
+    """
+    Pipeline completo de una factura: preprocesado, OCR y extracción
+    Devuelve la respuesta JSON del endpoint (con `timings` si se pide)
+    """
+    if is_pdf(image_bytes):
+        return run_pdf_pipeline(image_bytes, search_mode, filename, debug, include_timings)
     
-    lines = text.split('\n')
-    
-    # Buscar número de factura (más flexible para facturas colombianas)
-    invoice_patterns = [
-        r'(?:factura|invoice|fact\.?|FACTURA|ELECTRONICA)\s*(?:n[úuº°]?\.?|number|#|NUM|No)?\s*:?\s*([A-Z0-9\-/]{3,})',
-        r'(?:n[úuº°]?\.?|number|#|NUM|No)\s*(?:factura|invoice)?\s*:?\s*([A-Z0-9\-/]{3,})',
-        r'FACTURA\s+ELECTRONICA\s+DE\s+VENTA\s+No\.?\s*([A-Z0-9\-]+)',  # KFC format
-        r'FACTURA\s+ELECTRONICA\s*:?\s*([A-Z0-9]+)',
-        r'C\d+-\d+',  # Formato KFC C168-152015
-        r'F-\d{4}-\d+',  # Formato común F-2024-001
-        r'[A-Z]{1,3}\d{8,}',  # Formato tipo AB12345678
-    ]
-    for pattern in invoice_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            if match.lastindex:
-                data['invoice_number'] = match.group(1).strip()
-            else:
-                data['invoice_number'] = match.group(0).strip()
-            break
-    
-    # Buscar fecha (mejorado para incluir hora)
-    date_patterns = [
-        r'(\d{1,2}[/-]\d{1,2}[/-]\d{4}\s+\d{1,2}:\d{2}:\d{2})',  # 9/10/2025 10:37:21
-        r'(\d{1,2}[/-]\d{1,2}[/-]\d{4}\s+\d{1,2}:\d{2})',  # 9/10/2025 10:37
-        r'(?:fecha|date|FECHA)\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'(\d{1,2}[/-]\d{1,2}[/-]\d{4})',  # 9/10/2025
-        r'(\d{1,2}[/-]\d{1,2}[/-]\d{2})',  # 9/10/25
-        r'(\d{1,2}\s+(?:de\s+)?(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)\s+(?:de\s+)?\d{4})'
-    ]
-    for pattern in date_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            data['date'] = match.group(1).strip()
-            break
-    
-    # Buscar NIF/CIF/NIT (mejorado para facturas colombianas)
-    nif_patterns = [
-        r'\b([A-Z]\d{7}[A-Z0-9]|\d{8}[A-Z])\b',  # Formato español
-        r'NIT\s*:?\s*(\d{1,3}-\d{1,3})',  # Formato colombiano NIT: 901-2
-        r'NIT\s*:?\s*(\d{6,12})',  # NIT sin guiones
-        r'(\d{1,3}-\d{1,3})\s*(?:NIT|nit)',  # NIT al final
-    ]
-    for pattern in nif_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            data['nif_cif'] = match.group(1)
-            break
-    
-    # Buscar total (mejorado para PESOS COLOMBIANOS con $)
-    total_patterns = [
-        r'(?:total|TOTAL|amount|IMPORTE)\s*:?\s*[$€]?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',
-        r'\$\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # $3,000 o $3.000
-        r'(\d{1,3}(?:[.,]\d{3})+)\s*(?:COP|cop|pesos)?',  # 3,000 o 3.000
-        r'TOTAL\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # KFC format
-        r'(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})\s*[$€]?\s*(?:total|TOTAL)?',
-        r'Total\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # Case sensitive
-    ]
-    
-    found_amounts = []
-    for pattern in total_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            try:
-                # Normalizar el formato (pesos colombianos suelen usar . como separador de miles)
-                amount_str = match.replace(' ', '').replace('$', '').strip()
-                
-                # Para pesos colombianos: punto como separador de miles, coma como decimal
-                # Pero también puede ser al revés según la región
-                if '.' in amount_str and ',' in amount_str:
-                    # Si tiene ambos, el último es el decimal
-                    if amount_str.rfind('.') > amount_str.rfind(','):
-                        # punto es decimal: 1,000.50
-                        amount_str = amount_str.replace(',', '')
-                    else:
-                        # coma es decimal: 1.000,50
-                        amount_str = amount_str.replace('.', '').replace(',', '.')
-                elif '.' in amount_str:
-                    # Solo punto: puede ser miles o decimal
-                    parts = amount_str.split('.')
-                    if len(parts) == 2 and len(parts[1]) == 3:
-                        # Es separador de miles: 3.000 -> 3000
-                        amount_str = amount_str.replace('.', '')
-                    # Si tiene 2 dígitos después del punto, es decimal
-                elif ',' in amount_str:
-                    # Solo coma: puede ser miles o decimal
-                    parts = amount_str.split(',')
-                    if len(parts) == 2 and len(parts[1]) == 3:
-                        # Es separador de miles: 3,000 -> 3000
-                        amount_str = amount_str.replace(',', '')
-                    else:
-                        # Es decimal
-                        amount_str = amount_str.replace(',', '.')
-                
-                amount = float(amount_str)
-                if 1 <= amount <= 999999999:  # Rango razonable para pesos colombianos
-                    found_amounts.append(amount)
-            except:
-                continue
-    
-    if found_amounts:
-        # El total suele ser el mayor valor
-        data['total_amount'] = max(found_amounts)
-        data['currency'] = 'COP'  # Pesos colombianos
-    
-    # Buscar IVA/Tax (mejorado para facturas colombianas)
-    tax_patterns = [
-        r'(?:IVA|VAT|tax)\s*(?:\d{1,2}%)?\s*:?\s*€?\s*(\d{1,3}(?:[.,]\d{3})*[.,]\d{2})',
-        r'IVA\s*19%\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # KFC format
-        r'IVA\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',
-        r'(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})\s*\$?\s*(?:IVA|VAT)',
-    ]
-    for pattern in tax_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            data['tax'] = float(match.group(1).replace(',', '.').replace('.', '', match.group(1).count('.')-1))
-            break
-    
-    # Buscar EMAIL
-    email_patterns = [
-        r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-        r'(?:email|correo|e-mail|EMAIL)\s*:?\s*([A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,})',
-    ]
-    for pattern in email_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            if match.lastindex:
-                data['email'] = match.group(1).strip().lower()
-            else:
-                data['email'] = match.group(0).strip().lower()
-            break
-    
-    # Buscar CLIENTE (puede aparecer con etiqueta)
-    client_patterns = [
-        r'(?:cliente|client|CLIENTE)\s*:?\s*\d+\s*\n?\s*([A-Z][A-Za-z\s]{3,50})',
-        r'(?:cliente|client|CLIENTE)\s*:?\s*([A-Z][A-Za-z\s]{3,50})',
-        r'CLIENTE\s*:\s*\d+\s*\n([^\n]{5,50})',
-    ]
-    for pattern in client_patterns:
-        match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-        if match:
-            client = match.group(1).strip()
-            # Limpiar el nombre del cliente
-            if len(client) > 3 and not any(x in client.lower() for x in ['factura', 'fecha', 'total', 'cif', 'nif']):
-                data['client_name'] = client
+    timings = Timings()
+    with timings.stage('hash'):
+        image_hash = content_hash(image_bytes)
+    key = make_key(image_hash, 'invoice', pipeline_signature(), search_mode)
+    deadline = request_deadline()
+    
+    def compute():
+        # Preprocesar la imagen
+        processed_image, preprocessing_info = get_preprocessed_image(image_bytes, image_hash, deadline, timings)
+        
+        # Guardar imagen procesada para debugging (opcional, en segundo plano)
+        save_debug_image(processed_image, debug)
+        
+        # Realizar OCR buscando la mejor configuración
+        text, ocr_data, best = ocr_best(
+            processed_image, search_mode, deadline, timings, processed_text_height(preprocessing_info)
+        )
+        timings.configs_ms = best['config_ms']
+        
+        # Extraer datos estructurados
+        with timings.stage('extract'):
+            invoice_data = extract_invoice_data(text)
+        if not best['timed_out']:
+            with timings.stage('store'):
+                store_ocr_result(image_hash, text, ocr_data, best['config'], best['score'], invoice_data, filename)
+        
+        words_with_positions = words_from_ocr_data(ocr_data)
+        
+        response = {
+            'success': True,
+            'invoice_data': invoice_data,
+            'words': words_with_positions,
+            'processing_info': {
+                'total_words': len(words_with_positions),
+                'average_confidence': average_confidence(words_with_positions),
+                'ocr_config': best['config'],
+                'ocr_score': best['score'],
+                'search_mode': best['search_mode'],
+                'configs_tried': best['configs_tried'],
+                'timed_out': best['timed_out'],
+                'skew_angle': preprocessing_info.get('skew_angle', 0.0),
+                'orientation': page_rotation(preprocessing_info),
+                'preprocessing': preprocessing_info
+            }
+        }
+        # Detalle de los modos por regiones y dirigido
+        for key in ('layout', 'targeted'):
+            if key in best:
+                response['processing_info'][key] = best[key]
+        return response
+    
+    response, tier = cached_result(key, compute, timings)
+    response['processing_info']['cache'] = tier or 'miss'
+    if include_timings:
+        response['timings'] = timings.as_dict()
+    return response
+
+def ocr_pdf_page(page_number, image, search_mode, deadline=None, debug=False, timings=None):
+    """Preprocesado y OCR de una página rasterizada de un PDF"""
+    try:
+        processed_image, preprocessing_info = preprocess(image, settings['PDF_DPI'], deadline, timings)
+    except DeadlineExceeded:
+        # Sin tiempo para esta página: se devuelve vacía
+        return {'page': page_number, 'source': 'skipped', 'text': '', 'data': None, 'timed_out': True}
+    del image
+    save_debug_image(processed_image, debug, f'page{page_number}')
+    text, ocr_data, best = ocr_best(
+        processed_image, search_mode, deadline, timings, processed_text_height(preprocessing_info)
+    )
+    return {
+        'page': page_number,
+        'source': 'ocr',
+        'timed_out': best['timed_out'],
+        'text': text,
+        'data': ocr_data,
+        'ocr_config': best['config'],
+        'ocr_score': best['score'],
+        'configs_tried': best['configs_tried'],
+        'skew_angle': preprocessing_info.get('skew_angle', 0.0),
+        'orientation': page_rotation(preprocessing_info),
+        'preprocessing': preprocessing_info,
+    }
+
+def merge_ocr_data(pages):
+    """Une las palabras de image_to_data de todas las páginas (page_num = página del PDF)"""
+    merged = {}
+    for page in pages:
+        data = page['data']
+        if not data:
+            continue
+        for column, values in data.items():
+            if column == 'page_num':
+                values = [page['page']] * len(values)
+            merged.setdefault(column, []).extend(values)
+    return merged
+
+def run_pdf_pipeline(pdf_bytes, search_mode, filename=None, debug=False, include_timings=False):
+    """
+    Pipeline de una factura en PDF
+    Las páginas con capa de texto no pasan por OCR; las escaneadas se
+    rasterizan de una en una y se procesan en paralelo (como mucho
+    PDF_MAX_IN_FLIGHT a la vez, para acotar la memoria). El texto de todas
+    las páginas se une en un único registro de factura.
+    En `timings`, preprocess y ocr suman el tiempo de todas las páginas.
+    """
+    timings = Timings()
+    with timings.stage('hash'):
+        pdf_hash = content_hash(pdf_bytes)
+    key = make_key(pdf_hash, 'invoice-pdf', pipeline_signature(), search_mode, settings['PDF_DPI'])
+    deadline = request_deadline()
+    
+    def compute():
+        futures = []
+        pending = set()
+        pages = iter_pages(
+            pdf_bytes,
+            dpi=settings['PDF_DPI'],
+            min_text_chars=settings['PDF_MIN_TEXT_CHARS'],
+            max_pages=settings['PDF_MAX_PAGES']
+        )
+        timed_out = False
+        for page in pages:
+            # Sin tiempo no se leen más páginas
+            if deadline.expired():
+                timed_out = True
                 break
+            if page['text'] is not None:
+                future = Future()
+                future.set_result({'page': page['page'], 'source': 'text_layer', 'text': page['text'], 'data': None})
+            else:
+                future = pdf_executor.submit(ocr_pdf_page, page['page'], page['image'], search_mode, deadline, debug, timings)
+                pending.add(future)
+            futures.append(future)
+            del page
+            
+            # Limitar las páginas rasterizadas en vuelo
+            while len(pending) >= settings['PDF_MAX_IN_FLIGHT']:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        
+        pages.close()
+        
+        results = [future.result() for future in futures]
+        timed_out = timed_out or any(page.get('timed_out') for page in results)
+        ocr_pages = [page for page in results if page['source'] == 'ocr']
+        print(f"📄 PDF: {len(results)} páginas ({len(ocr_pages)} con OCR)")
+        
+        text = '\n\n'.join(page['text'] for page in results)
+        with timings.stage('extract'):
+            invoice_data = extract_invoice_data(text)
+        
+        ocr_data = merge_ocr_data(results)
+        words_with_positions = []
+        for page in ocr_pages:
+            words_with_positions.extend(words_from_ocr_data(page['data'], page=page['page']))
+        
+        configs = [page['ocr_config'] for page in ocr_pages]
+        ocr_config = max(set(configs), key=configs.count) if configs else 'text_layer'
+        ocr_score = sum(page['ocr_score'] for page in ocr_pages) / len(ocr_pages) if ocr_pages else None
+        if not timed_out:
+            store_ocr_result(pdf_hash, text, ocr_data, ocr_config, ocr_score, invoice_data, filename)
+        
+        return {
+            'success': True,
+            'invoice_data': invoice_data,
+            'words': words_with_positions,
+            'processing_info': {
+                'total_words': len(words_with_positions),
+                'average_confidence': average_confidence(words_with_positions),
+                'ocr_config': ocr_config,
+                'ocr_score': ocr_score,
+                'search_mode': search_mode,
+                'configs_tried': sum(page['configs_tried'] for page in ocr_pages),
+                'timed_out': timed_out,
+                'skew_angle': ocr_pages[0]['skew_angle'] if ocr_pages else 0.0,
+                'source': 'pdf',
+                'page_count': len(results),
+                'pages': [
+                    {k: v for k, v in page.items() if k not in ('text', 'data')}
+                    for page in results
+                ]
+            }
+        }
     
-    # Si no se encontró cliente con patrón, buscar después de "CLIENTE:"
-    if not data['client_name']:
-        for i, line in enumerate(lines):
-            if 'cliente' in line.lower() and ':' in line:
-                # Buscar en las siguientes líneas
-                for j in range(i+1, min(i+4, len(lines))):
-                    candidate = lines[j].strip()
-                    if len(candidate) > 3 and not candidate.isdigit():
-                        data['client_name'] = candidate
-                        break
-                if data['client_name']:
-                    break
-    
-    # Buscar nombre del vendedor/proveedor (primeras líneas no vacías)
-    for line in lines[:10]:
-        line = line.strip()
-        if line and len(line) > 5 and not any(keyword in line.lower() for keyword in ['factura', 'invoice', 'fecha', 'date', 'cliente', 'tel', 'email', 'cif', 'nif']):
-            # Buscar líneas que parezcan nombres de empresa
-            if any(x in line.upper() for x in ['SL', 'SA', 'S.L.', 'S.A.', 'SRL', 'LTDA']) or line[0].isupper():
-                data['vendor_name'] = line
+    response, tier = cached_result(key, compute, timings)
+    response['processing_info']['cache'] = tier or 'miss'
+    if include_timings:
+        response['timings'] = timings.as_dict()
+    return response
+
+def run_receipt_pipeline(image_bytes):
+    """Pipeline simplificado para tickets/recibos"""
+    image_hash = content_hash(image_bytes)
+    key = make_key(image_hash, 'receipt', pipeline_signature())
+    deadline = request_deadline()
+    
+    def compute():
+        timings = Timings()
+        
+        # Preprocesar
+        processed_image, _ = get_preprocessed_image(image_bytes, image_hash, deadline, timings)
+        
+        # OCR más agresivo para tickets: una sola pasada, así que sin el
+        # timeout por configuración del barrido (solo el de la petición)
+        custom_config = r'--oem 3 --psm 4 -l spa'
+        try:
+            with timings.stage('ocr'):
+                text, _ = ocr_engine.run(processed_image, custom_config, deadline=deadline, config_timeout=0)
+        except (DeadlineExceeded, RuntimeError):
+            if not deadline.expired():
+                raise
+            # Si el timeout fue por el presupuesto de la petición, informarlo como tal
+            TIMEOUTS.inc(stage='ocr')
+            deadline.check('el OCR')
+        
+        # Extraer datos básicos
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        
+        # Buscar total de manera más flexible
+        total = None
+        for line in lines:
+            match = re.search(r'(\d{1,3}(?:[.,]\d{3})*[.,]\d{2})', line)
+            if match and ('total' in line.lower() or 'importe' in line.lower()):
+                total = match.group(1)
                 break
+        
+        return {
+            'success': True,
+            'text': text,
+            'lines': lines,
+            'total': total
+        }
     
-    # Calcular confianza basada en datos encontrados
-    found_fields = sum([
-        1 if data['invoice_number'] else 0,
-        1 if data['date'] else 0,
-        1 if data['total_amount'] else 0,
-        1 if data['nif_cif'] else 0,
-        1 if data['vendor_name'] else 0,
-        1 if data['client_name'] else 0,
-        1 if data['email'] else 0,
-    ])
-    data['confidence'] = (found_fields / 7) * 100
-    
-    return data
-
-@app.route('/health', methods=['GET'])
+    response, _ = cached_result(key, compute)
+    return response
+
+def iter_batch_files(uploads):
+    """
+    Recorre los archivos de un lote devolviendo (nombre, bytes o error)
+    Los .zip se expanden y sus miembros se leen de uno en uno
+    """
+    for filename, stream in uploads:
+        with stream:
+            if filename.lower().endswith('.zip'):
+                try:
+                    archive = zipfile.ZipFile(stream)
+                except zipfile.BadZipFile:
+                    yield filename, InvalidImageError('Archivo zip no válido')
+                    continue
+                with archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or not allowed_file(member.filename):
+                            continue
+                        if member.file_size > settings['MAX_CONTENT_LENGTH']:
+                            yield member.filename, InvalidImageError('Archivo demasiado grande')
+                            continue
+                        yield member.filename, archive.read(member)
+            elif allowed_file(filename):
+                yield filename, stream.read()
+            else:
+                yield filename, InvalidImageError('Tipo de archivo no permitido')
+
+def batch_line(index, filename, future):
+    """Línea NDJSON con el resultado (o el error) de una factura del lote"""
+    try:
+        line = {'index': index, 'filename': filename, **future.result()}
+    except Exception as e:
+        line = {'index': index, 'filename': filename, 'success': False, 'error': str(e)}
+    return json.dumps(line) + '\n'
+
+def failed_future(error):
+    """Future ya resuelto con un error (archivos del lote que no se pueden procesar)"""
+    future = Future()
+    future.set_exception(error)
+    return future
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+@api.after_app_request
+def record_request_metrics(response):
+    """Cuenta la petición y su duración (en los lotes, hasta enviar las cabeceras)"""
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    started_at = g.get('request_started_at')
+    if started_at is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started_at, endpoint=endpoint)
+    return response
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api.route('/health', methods=['GET'])
 def health_check():
     """Endpoint para verificar que el servicio está funcionando"""
     return jsonify({
@@ -369,7 +659,18 @@ def health_check():
         'version': '1.0.0'
     })
 
-@app.route('/api/process-invoice', methods=['POST'])
+@api.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Contadores de aciertos/fallos y ocupación de las cachés"""
+    if result_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({
+        'enabled': True,
+        'results': result_cache.stats(),
+        'preprocessed_images': image_cache.stats()
+    })
+
+@api.route('/api/process-invoice', methods=['POST'])
 def process_invoice():
     """
     Endpoint principal para procesar facturas
@@ -388,160 +689,30 @@ def process_invoice():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Tipo de archivo no permitido'}), 400
         
-        # Leer la imagen
-        image_bytes = file.read()
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            return jsonify({'error': 'No se pudo leer la imagen'}), 400
-        
-        # Preprocesar la imagen
-        processed_image = preprocess_image(image)
-        
-        # Guardar imagen procesada para debugging (opcional)
-        try:
-            debug_filename = f"debug_processed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            debug_path = os.path.join(UPLOAD_FOLDER, debug_filename)
-            cv2.imwrite(debug_path, processed_image)
-            print(f"🔍 Imagen procesada guardada: {debug_path}")
-        except:
-            pass
-        
-        # Realizar OCR con configuraciones OPTIMIZADAS (solo las mejores)
-        # Probar solo las configuraciones más efectivas para evitar timeouts
-        configs = [
-            # Configuraciones básicas más efectivas
-            r'--oem 1 --psm 3 -l spa',  # Automático
-            r'--oem 1 --psm 6 -l spa',  # Bloque uniforme (mejor para facturas)
-            r'--oem 1 --psm 4 -l spa',  # Columna única
-            r'--oem 1 --psm 8 -l spa',  # Palabra única
-            
-            # Configuraciones agresivas más efectivas
-            r'--oem 3 --psm 3 -l spa',  # OEM 3 (más agresivo)
-            r'--oem 3 --psm 6 -l spa',  # OEM 3 + bloque uniforme
-            r'--oem 3 --psm 4 -l spa',  # OEM 3 + columna única
-            
-            # Sin idioma específico (más flexible)
-            r'--oem 1 --psm 3',  # Sin idioma
-            r'--oem 3 --psm 3',  # OEM 3 sin idioma
-            r'--oem 1 --psm 6',  # Sin idioma + bloque
-            r'--oem 3 --psm 6',  # OEM 3 sin idioma + bloque
-        ]
-        
-        best_text = ""
-        best_confidence = 0
-        best_config = configs[0]
+        # Modo de búsqueda de OCR (opcional, por defecto el de la configuración)
+        search_mode = request.values.get('search_mode') or settings['OCR_SEARCH_MODE']
+        if search_mode not in SEARCH_MODES:
+            return jsonify({'error': f'Modo de búsqueda no válido: {search_mode}'}), 400
         
-        print(f"🔍 Probando {len(configs)} configuraciones OPTIMIZADAS de OCR...")
-        
-        import signal
-        
-        def timeout_handler(signum, frame):
-            raise TimeoutError("OCR timeout")
-        
-        for i, config in enumerate(configs):
-            try:
-                # Configurar timeout de 10 segundos por configuración
-                signal.signal(signal.SIGALRM, timeout_handler)
-                signal.alarm(10)
-                
-                temp_text = pytesseract.image_to_string(processed_image, config=config)
-                temp_data = pytesseract.image_to_data(processed_image, config=config, output_type=pytesseract.Output.DICT)
-                
-                # Cancelar timeout
-                signal.alarm(0)
-                
-                # Calcular confianza promedio
-                confidences = [int(conf) for conf in temp_data['conf'] if conf != '-1']
-                avg_conf = sum(confidences) / len(confidences) if confidences else 0
-                
-                # Sistema de scoring INTELIGENTE
-                text_length = len(temp_text.strip())
-                text_quality = text_length * 0.1
-                
-                # Bonus por palabras clave de facturas
-                keywords = ['factura', 'total', 'iva', 'fecha', 'nit', 'cif', 'cliente', 'proveedor']
-                keyword_bonus = sum([1 for keyword in keywords if keyword.lower() in temp_text.lower()]) * 5
-                
-                # Bonus por números (importante en facturas)
-                numbers = len(re.findall(r'\d+', temp_text))
-                number_bonus = numbers * 0.5
-                
-                # Bonus por símbolos de moneda
-                currency_bonus = len(re.findall(r'[$€]', temp_text)) * 3
-                
-                # Penalización por texto muy corto o muy largo
-                length_penalty = 0
-                if text_length < 50:
-                    length_penalty = -10
-                elif text_length > 2000:
-                    length_penalty = -5
-                
-                combined_score = avg_conf + text_quality + keyword_bonus + number_bonus + currency_bonus + length_penalty
-                
-                print(f"  Config {i+1:2d}: Conf={avg_conf:5.1f}%, Text={text_length:4d} chars, KW={keyword_bonus:2.0f}, Num={number_bonus:2.0f}, $={currency_bonus:2.0f}, Score={combined_score:6.1f}")
-                
-                if combined_score > best_confidence:
-                    best_confidence = combined_score
-                    best_text = temp_text
-                    best_config = config
-                    
-            except TimeoutError:
-                print(f"  Config {i+1:2d}: Timeout - saltando...")
-                signal.alarm(0)  # Cancelar timeout
-                continue
-            except Exception as e:
-                print(f"  Config {i+1:2d}: Error - {str(e)}")
-                signal.alarm(0)  # Cancelar timeout
-                continue
-        
-        text = best_text if best_text else pytesseract.image_to_string(processed_image, config=configs[0])
-        print(f"✅ Mejor configuración: {best_config}")
-        print(f"📊 Confianza final: {best_confidence:.1f}")
-        print(f"📝 Texto extraído: {len(text)} caracteres")
-        
-        # Extraer datos estructurados
-        invoice_data = extract_invoice_data(text)
-        
-        # También obtener datos con coordenadas (similar a Textract)
-        ocr_data = pytesseract.image_to_data(processed_image, config=configs[0], output_type=pytesseract.Output.DICT)
-        
-        # Organizar palabras por líneas con coordenadas
-        words_with_positions = []
-        n_boxes = len(ocr_data['text'])
-        for i in range(n_boxes):
-            if int(ocr_data['conf'][i]) > 30:  # Solo palabras con confianza > 30%
-                words_with_positions.append({
-                    'text': ocr_data['text'][i],
-                    'confidence': float(ocr_data['conf'][i]),
-                    'bounding_box': {
-                        'x': int(ocr_data['left'][i]),
-                        'y': int(ocr_data['top'][i]),
-                        'width': int(ocr_data['width'][i]),
-                        'height': int(ocr_data['height'][i])
-                    }
-                })
-        
-        response = {
-            'success': True,
-            'invoice_data': invoice_data,
-            'words': words_with_positions,
-            'processing_info': {
-                'total_words': len(words_with_positions),
-                'average_confidence': sum([w['confidence'] for w in words_with_positions]) / len(words_with_positions) if words_with_positions else 0
-            }
-        }
+        # Leer la imagen y procesarla
+        image_bytes = file.read()
+        response = run_invoice_pipeline(
+            image_bytes, search_mode, file.filename, request_flag('debug'), request_flag('timings')
+        )
         
         return jsonify(response), 200
         
+    except (InvalidImageError, PDFError) as e:
+        return jsonify({'error': str(e)}), 400
+    except DeadlineExceeded as e:
+        return jsonify({'success': False, 'timed_out': True, 'error': str(e)}), 504
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/analyze-receipt', methods=['POST'])
+@api.route('/api/analyze-receipt', methods=['POST'])
 def analyze_receipt():
     """
     Endpoint simplificado para tickets/recibos
@@ -552,45 +723,129 @@ def analyze_receipt():
         
         file = request.files['file']
         
-        # Leer la imagen
+        # Leer la imagen y procesarla
         image_bytes = file.read()
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Preprocesar
-        processed_image = preprocess_image(image)
-        
-        # OCR más agresivo para tickets
-        custom_config = r'--oem 3 --psm 4 -l spa'
-        text = pytesseract.image_to_string(processed_image, config=custom_config)
-        
-        # Extraer datos básicos
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        response = run_receipt_pipeline(image_bytes)
         
-        # Buscar total de manera más flexible
-        total = None
-        for line in lines:
-            match = re.search(r'(\d{1,3}(?:[.,]\d{3})*[.,]\d{2})', line)
-            if match and ('total' in line.lower() or 'importe' in line.lower()):
-                total = match.group(1)
-                break
-        
-        return jsonify({
-            'success': True,
-            'text': text,
-            'lines': lines,
-            'total': total
-        }), 200
+        return jsonify(response), 200
         
+    except (InvalidImageError, PDFError) as e:
+        return jsonify({'error': str(e)}), 400
+    except DeadlineExceeded as e:
+        return jsonify({'success': False, 'timed_out': True, 'error': str(e)}), 504
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@api.route('/api/jobs', methods=['POST'])
+def submit_jobs():
+    """
+    Encola una o varias facturas para procesarlas en segundo plano
+    Devuelve los ids de los trabajos inmediatamente (202)
+    """
+    files = request.files.getlist('file') + request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No se encontró ningún archivo'}), 400
+    
+    for file in files:
+        if file.filename == '':
+            return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
+        if not allowed_file(file.filename):
+            return jsonify({'error': f'Tipo de archivo no permitido: {file.filename}'}), 400
+    
+    search_mode = request.values.get('search_mode') or settings['OCR_SEARCH_MODE']
+    if search_mode not in SEARCH_MODES:
+        return jsonify({'error': f'Modo de búsqueda no válido: {search_mode}'}), 400
+    
+    options = {'search_mode': search_mode, 'debug': request_flag('debug'), 'include_timings': request_flag('timings')}
+    payloads = [(file.filename, file.read(), dict(options, filename=file.filename)) for file in files]
+    
+    try:
+        jobs = job_manager.submit_many(payloads)
+    except QueueFullError as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.headers['Retry-After'] = str(settings['JOB_RETRY_AFTER'])
+        return response, 429
+    
+    return jsonify({
+        'success': True,
+        'jobs': [
+            {
+                'id': job['id'],
+                'filename': job['filename'],
+                'status': job['status'],
+                'status_url': url_for('api.get_job', job_id=job['id'])
+            }
+            for job in jobs
+        ]
+    }), 202
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado de un trabajo y, cuando termina, su resultado"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job), 200
+
+@api.route('/api/process-invoices/batch', methods=['POST'])
+def process_invoices_batch():
+    """
+    Procesa muchas facturas en una sola petición
+    Acepta varios archivos y/o archivos .zip y devuelve NDJSON: una línea
+    por factura, en el orden en que van terminando
+    """
+    # Los lotes pueden superar el límite de una petición normal
+    request.max_content_length = settings['BATCH_MAX_CONTENT_LENGTH']
+    
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No se encontró ningún archivo'}), 400
+    
+    search_mode = request.values.get('search_mode') or settings['OCR_SEARCH_MODE']
+    if search_mode not in SEARCH_MODES:
+        return jsonify({'error': f'Modo de búsqueda no válido: {search_mode}'}), 400
+    
+    max_in_flight = settings['BATCH_MAX_IN_FLIGHT']
+    debug = request_flag('debug')
+    include_timings = request_flag('timings')
+    
+    # Flask cierra los archivos de la petición al salir de la vista: el
+    # generador se queda con los streams y los cierra a medida que los lee
+    uploads = []
+    for file in files:
+        uploads.append((file.filename, file.stream))
+        file.stream = io.BytesIO()
+    
+    def generate():
+        pending = {}
+        for index, (filename, content) in enumerate(iter_batch_files(uploads)):
+            if isinstance(content, Exception):
+                future = failed_future(content)
+            else:
+                future = batch_executor.submit(run_invoice_pipeline, content, search_mode, filename, debug, include_timings)
+            pending[future] = (index, filename)
+            
+            # Limitar las facturas en vuelo para acotar la memoria
+            while len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield batch_line(*pending.pop(future), future)
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield batch_line(*pending.pop(future), future)
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
+    # Servidor de desarrollo; en producción: gunicorn -c gunicorn.conf.py "app:create_app()"
+    app = create_app()
     print("🚀 Iniciando servidor de procesamiento de facturas...")
     print("📄 Similar a Amazon Textract pero con Tesseract + OpenCV")
     print("🌐 Servidor corriendo en http://localhost:5001")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    app.run(host='0.0.0.0', port=5001, debug=app.config['DEBUG'])
 
@@ -0,0 +1,228 @@
+"""
+Caché de resultados por contenido
+
+Las claves se forman con el hash SHA-256 de los bytes subidos más la versión
+del pipeline, así que reintentos con la misma foto no repiten el OCR.
+
+- LRUCache: nivel en memoria con límite de entradas, de bytes y TTL
+- DiskCache: nivel opcional en disco (sqlite) compartido entre procesos
+- ResultCache: combina ambos niveles y lleva contadores de aciertos/fallos
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def content_hash(data):
+    """Hash del contenido subido"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*parts):
+    """Clave de caché a partir del hash y de lo que define el resultado"""
+    return ':'.join(str(part) for part in parts)
+
+
+@contextmanager
+def sqlite_connection(path, timeout=5):
+    """
+    Conexión sqlite para una sola operación (se confirma al salir sin error)
+    Una conexión por operación es seguro entre hilos y procesos; la usan
+    DiskCache y ocr_store.OCRStore
+    """
+    conn = sqlite3.connect(path, timeout=timeout)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class LRUCache:
+    """Caché en memoria con expulsión LRU por número de entradas, bytes y TTL"""
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl=3600, size_of=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_of = size_of
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # clave -> (valor, tamaño, caducidad)
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, size, expires_at = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self.size_of(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+
+class DiskCache:
+    """Caché en disco (sqlite) para resultados serializados en JSON"""
+
+    def __init__(self, path, ttl=86400, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with sqlite_connection(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)'
+            )
+
+    def get(self, key):
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with sqlite_connection(self.path) as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)', (key, value, now))
+            # Expulsar lo caducado y lo más antiguo por encima del límite
+            conn.execute('DELETE FROM cache WHERE created < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        with sqlite_connection(self.path) as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'entries': entries, 'path': self.path}
+
+
+class ResultCache:
+    """
+    Caché de respuestas JSON en dos niveles (memoria y, opcionalmente, disco)
+    Los valores se guardan serializados para que nadie modifique la copia cacheada
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        """Devuelve (valor, nivel) donde nivel es 'memory', 'disk' o None"""
+        payload = self.memory.get(key)
+        if payload is not None:
+            self._count('memory_hits')
+            return json.loads(payload), 'memory'
+
+        if self.disk is not None:
+            try:
+                payload = self.disk.get(key)
+            except sqlite3.Error as e:
+                print(f"⚠️  Error leyendo la caché en disco: {e}")
+                payload = None
+            if payload is not None:
+                self._count('disk_hits')
+                self.memory.set(key, payload)
+                return json.loads(payload), 'disk'
+
+        self._count('misses')
+        return None, None
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        self.memory.set(key, payload)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, payload)
+            except sqlite3.Error as e:
+                print(f"⚠️  Error escribiendo la caché en disco: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0
+        stats['memory'] = self.memory.stats()
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+
+class ImageCache:
+    """Caché en memoria de imágenes preprocesadas (arrays de numpy de solo lectura)"""
+
+    def __init__(self, max_entries=32, max_bytes=256 * 1024 * 1024, ttl=3600):
+        self.memory = LRUCache(max_entries, max_bytes, ttl, size_of=lambda item: item[0].nbytes)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get(self, key):
+        """Devuelve (imagen, info) o None; info se copia para poder modificarla"""
+        item = self.memory.get(key)
+        with self._lock:
+            self.counters['hits' if item is not None else 'misses'] += 1
+        if item is None:
+            return None
+        image, info = item
+        return image, copy.deepcopy(info)
+
+    def set(self, key, image, info):
+        image.setflags(write=False)
+        self.memory.set(key, (image, info))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['memory'] = self.memory.stats()
+        return stats
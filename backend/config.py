@@ -3,6 +3,20 @@ Configuración del sistema de procesamiento de facturas
 """
 import os
 
+def env_bool(name, default):
+    """Lee una variable de entorno booleana ('1', 'true', 'yes', 'on')"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def upload_path(upload_folder, path):
+    """
+    Ruta de un archivo de datos de la app: las relativas cuelgan del
+    UPLOAD_FOLDER de la configuración activa (None = desactivado)
+    """
+    return os.path.join(upload_folder, path) if path else path
+
 class Config:
     """Configuración base"""
     # Flask
@@ -17,10 +31,83 @@ class Config:
     TESSERACT_LANG = 'spa'  # Idioma principal
     TESSERACT_CONFIG = r'--oem 3 --psm 6'
     
+    # Backend de Tesseract: 'auto' (tesserocr si está instalado), 'tesserocr' o 'pytesseract'
+    OCR_BACKEND = os.environ.get('OCR_BACKEND', 'auto')
+    
+    # OCR en paralelo: workers del pool (0 = un worker por núcleo)
+    OCR_MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', 0)) or os.cpu_count() or 1
+    OCR_CONFIG_TIMEOUT = int(os.environ.get('OCR_CONFIG_TIMEOUT', 10))  # segundos por configuración
+    
+    # Presupuesto de tiempo por factura (preprocesado + OCR); al agotarse se mata
+    # Tesseract y se devuelve el mejor resultado parcial (0 = sin límite)
+    REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 60))
+    
+    # Búsqueda de la mejor configuración: 'exhaustive' (todas) o 'adaptive'
+    OCR_SEARCH_MODE = os.environ.get('OCR_SEARCH_MODE', 'exhaustive')
+    OCR_SCORE_THRESHOLD = float(os.environ.get('OCR_SCORE_THRESHOLD', 150))  # score para parar antes
+    OCR_ADAPTIVE_PATIENCE = int(os.environ.get('OCR_ADAPTIVE_PATIENCE', 2))  # grupos sin mejora antes de parar
+    OCR_ADAPTIVE_BATCH = int(os.environ.get('OCR_ADAPTIVE_BATCH', 1))  # configuraciones por grupo
+    OCR_STATS_FILE = 'ocr_config_stats.json'  # historial de victorias (relativo a UPLOAD_FOLDER)
+    
+    # Versión del pipeline: forma parte de la clave de caché, subirla al
+    # cambiar preprocesamiento, configuraciones de OCR o extracción
+    PIPELINE_VERSION = '3'
+    
+    # Caché de resultados por contenido (nivel en memoria + disco opcional)
+    CACHE_ENABLED = env_bool('CACHE_ENABLED', True)
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 256))
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))  # segundos
+    CACHE_DISK_ENABLED = env_bool('CACHE_DISK_ENABLED', False)
+    CACHE_DISK_PATH = 'cache.sqlite3'  # relativo a UPLOAD_FOLDER
+    CACHE_DISK_TTL = int(os.environ.get('CACHE_DISK_TTL', 7 * 24 * 3600))
+    CACHE_DISK_MAX_ENTRIES = int(os.environ.get('CACHE_DISK_MAX_ENTRIES', 10000))
+    
+    # Almacén del OCR de cada factura para re-extraer sin repetir el OCR (reextract.py)
+    OCR_STORE_ENABLED = env_bool('OCR_STORE_ENABLED', True)
+    OCR_STORE_PATH = os.environ.get('OCR_STORE_PATH', 'ocr_store.sqlite3')  # relativo a UPLOAD_FOLDER
+    
+    # Caché de imágenes preprocesadas (compartida entre endpoints)
+    PREPROCESS_CACHE_MAX_ENTRIES = int(os.environ.get('PREPROCESS_CACHE_MAX_ENTRIES', 16))
+    PREPROCESS_CACHE_MAX_BYTES = int(os.environ.get('PREPROCESS_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    
+    # Trabajos asíncronos (/api/jobs)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # facturas procesadas a la vez
+    JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))  # pendientes antes de responder 429
+    JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))  # segundos que se guardan los resultados
+    JOB_RETRY_AFTER = 5  # segundos sugeridos al cliente cuando la cola está llena
+    JOB_STORE_PATH = 'jobs.sqlite3'  # cola compartida por los workers (relativo a UPLOAD_FOLDER)
+    
+    # Lotes (/api/process-invoices/batch)
+    BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 2))  # facturas del lote procesadas a la vez
+    BATCH_MAX_IN_FLIGHT = int(os.environ.get('BATCH_MAX_IN_FLIGHT', 8))  # facturas leídas y pendientes
+    BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', 1024 * 1024 * 1024))  # 1GB
+    
+    # PDF: las páginas con capa de texto no pasan por OCR, el resto se rasteriza
+    PDF_DPI = int(os.environ.get('PDF_DPI', 300))  # resolución de rasterizado
+    PDF_MIN_TEXT_CHARS = int(os.environ.get('PDF_MIN_TEXT_CHARS', 20))  # texto mínimo para no hacer OCR
+    PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 200))
+    PDF_PAGE_WORKERS = int(os.environ.get('PDF_PAGE_WORKERS', 2))  # páginas con OCR a la vez
+    PDF_MAX_IN_FLIGHT = int(os.environ.get('PDF_MAX_IN_FLIGHT', 4))  # páginas rasterizadas en memoria
+    
+    # Imágenes de depuración (imagen preprocesada): con el campo debug=1 en la
+    # petición o por muestreo; se escriben en segundo plano con retención
+    DEBUG_IMAGES_DIR = 'debug'  # relativo a UPLOAD_FOLDER
+    DEBUG_IMAGES_SAMPLE_RATE = float(os.environ.get('DEBUG_IMAGES_SAMPLE_RATE', 0.0))  # 0.0 - 1.0
+    DEBUG_IMAGES_QUEUE_SIZE = int(os.environ.get('DEBUG_IMAGES_QUEUE_SIZE', 8))  # si se llena se descartan
+    DEBUG_IMAGES_MAX_FILES = int(os.environ.get('DEBUG_IMAGES_MAX_FILES', 200))
+    DEBUG_IMAGES_MAX_BYTES = int(os.environ.get('DEBUG_IMAGES_MAX_BYTES', 512 * 1024 * 1024))
+    
     # OCR confidence threshold
     MIN_CONFIDENCE = 30  # Palabras con confianza < 30% se descartan
     
     # Image processing
+    PREPROCESSING_PROFILE = os.environ.get('PREPROCESSING_PROFILE', 'auto')  # perfil de preprocessing.py ('auto' = triaje)
+    PREPROCESSING_DECODE_MIN_PIXELS = int(os.environ.get('PREPROCESSING_DECODE_MIN_PIXELS', 8_000_000))  # reducir al decodificar
+    PREPROCESSING_DOCUMENT_CROP = env_bool('PREPROCESSING_DOCUMENT_CROP', True)  # recortar el papel en fotos
+    PREPROCESSING_ORIENTATION = env_bool('PREPROCESSING_ORIENTATION', False)  # girar páginas de lado o boca abajo
+    PREPROCESSING_TARGET_TEXT_HEIGHT = int(os.environ.get('PREPROCESSING_TARGET_TEXT_HEIGHT', 32))  # px por carácter
+    PREPROCESSING_MAX_PIXELS = int(os.environ.get('PREPROCESSING_MAX_PIXELS', 24_000_000))  # límite tras reescalar
     BILATERAL_D = 9
     BILATERAL_SIGMA_COLOR = 75
     BILATERAL_SIGMA_SPACE = 75
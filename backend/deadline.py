@@ -0,0 +1,53 @@
+"""
+Presupuesto de tiempo por petición
+
+Un Deadline se crea al empezar a procesar una factura y se comparte entre el
+preprocesamiento y todas las configuraciones de OCR. Cada pasada de
+Tesseract recibe como timeout lo que quede del presupuesto, así que al
+agotarse se mata el proceso (pytesseract) o se cancela el reconocimiento
+(tesserocr) en lugar de dejarlo consumiendo CPU. A diferencia de
+signal.alarm funciona desde cualquier hilo.
+"""
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el presupuesto de tiempo de la petición"""
+
+
+class Deadline:
+    """Instante límite de una petición (sin límite si `seconds` es 0 o None)"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds if seconds else None
+
+    def remaining(self):
+        """Segundos restantes (None si no hay límite)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def check(self, what='la petición'):
+        """Lanza DeadlineExceeded si ya no queda tiempo"""
+        if self.expired():
+            raise DeadlineExceeded(f'Tiempo agotado ({self.seconds} s) durante {what}')
+
+    def timeout(self, limit=0):
+        """
+        Timeout para una llamada: el menor entre `limit` (0 = sin límite
+        propio) y lo que quede del presupuesto
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        # Nunca devolver 0: para los backends significa "sin timeout"
+        remaining = max(remaining, 0.001)
+        return min(limit, remaining) if limit else remaining
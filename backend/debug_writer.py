@@ -0,0 +1,123 @@
+"""
+Escritura en segundo plano de las imágenes de depuración
+
+Guardar la imagen preprocesada como PNG puede costar decenas de MB de
+compresión y disco por petición, así que:
+- solo se guarda si la petición lo pide o por muestreo (sample_rate)
+- la escritura la hace un hilo propio con una cola acotada; si la cola está
+  llena la imagen se descarta en lugar de frenar la petición
+- se conservan como mucho `max_files` archivos y `max_bytes` bytes (se
+  borran los más antiguos)
+"""
+import glob
+import os
+import queue
+import random
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+import cv2
+
+
+class DebugWriter:
+    """Hilo que guarda imágenes de depuración con cola acotada y retención"""
+
+    def __init__(self, directory, sample_rate=0.0, max_queue=8, max_files=200,
+                 max_bytes=512 * 1024 * 1024, prefix='debug_processed'):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.counters = {'queued': 0, 'written': 0, 'dropped': 0, 'deleted': 0, 'errors': 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Archivos ya existentes (del más antiguo al más reciente) para aplicar la retención
+        existing = []
+        for path in glob.glob(os.path.join(directory, f'{prefix}_*.png')):
+            try:
+                existing.append((os.path.getmtime(path), path, os.path.getsize(path)))
+            except OSError:
+                continue
+        existing.sort()
+        self._files = deque((path, size) for _, path, size in existing)
+        self._bytes = sum(size for _, size in self._files)
+
+        self._thread = threading.Thread(target=self._run, name='debug-writer', daemon=True)
+        self._thread.start()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def wanted(self, requested=False):
+        """Si hay que guardar la imagen de esta petición (pedida o por muestreo)"""
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def submit(self, image, label=None):
+        """
+        Encola la imagen para guardarla sin bloquear; devuelve la ruta
+        prevista o None si la cola estaba llena
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        name = f"{self.prefix}_{timestamp}_{uuid.uuid4().hex[:8]}"
+        if label:
+            name += f"_{label}"
+        path = os.path.join(self.directory, name + '.png')
+
+        try:
+            self._queue.put_nowait((path, image))
+        except queue.Full:
+            self._count('dropped')
+            return None
+        self._count('queued')
+        return path
+
+    def _run(self):
+        while True:
+            path, image = self._queue.get()
+            try:
+                # Compresión rápida: las imágenes binarizadas comprimen bien igualmente
+                if not cv2.imwrite(path, image, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+                    raise OSError(f'cv2.imwrite falló: {path}')
+                self._files.append((path, os.path.getsize(path)))
+                self._bytes += self._files[-1][1]
+                self._count('written')
+                self._enforce_retention()
+            except Exception as e:
+                self._count('errors')
+                print(f"⚠️  No se pudo guardar la imagen de depuración: {e}")
+            finally:
+                del image
+                self._queue.task_done()
+
+    def _enforce_retention(self):
+        """Borra las imágenes más antiguas por encima de los límites"""
+        while self._files and (len(self._files) > self.max_files or self._bytes > self.max_bytes):
+            path, size = self._files.popleft()
+            self._bytes -= size
+            try:
+                os.remove(path)
+                self._count('deleted')
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        """Espera a que se escriban las imágenes pendientes"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update({
+            'pending': self._queue.qsize(),
+            'files': len(self._files),
+            'bytes': self._bytes,
+            'sample_rate': self.sample_rate,
+        })
+        return stats
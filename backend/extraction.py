@@ -0,0 +1,326 @@
+"""
+Extracción de campos de facturas a partir del texto OCR
+
+Todos los patrones se compilan una sola vez al importar el módulo y se
+agrupan por familia de campo (número, fecha, NIT, total, IVA, email,
+cliente). Dentro de cada familia se respeta la prioridad de los patrones:
+gana el primero que encuentra algo, igual que en la versión original.
+"""
+import re
+from functools import lru_cache
+from multiprocessing import Pool
+
+# Buscar número de factura (más flexible para facturas colombianas)
+INVOICE_PATTERNS = [
+    r'(?:factura|invoice|fact\.?|FACTURA|ELECTRONICA)\s*(?:n[úuº°]?\.?|number|#|NUM|No)?\s*:?\s*([A-Z0-9\-/]{3,})',
+    r'(?:n[úuº°]?\.?|number|#|NUM|No)\s*(?:factura|invoice)?\s*:?\s*([A-Z0-9\-/]{3,})',
+    r'FACTURA\s+ELECTRONICA\s+DE\s+VENTA\s+No\.?\s*([A-Z0-9\-]+)',  # KFC format
+    r'FACTURA\s+ELECTRONICA\s*:?\s*([A-Z0-9]+)',
+    r'C\d+-\d+',  # Formato KFC C168-152015
+    r'F-\d{4}-\d+',  # Formato común F-2024-001
+    r'[A-Z]{1,3}\d{8,}',  # Formato tipo AB12345678
+]
+
+# Buscar fecha (mejorado para incluir hora)
+DATE_PATTERNS = [
+    r'(\d{1,2}[/-]\d{1,2}[/-]\d{4}\s+\d{1,2}:\d{2}:\d{2})',  # 9/10/2025 10:37:21
+    r'(\d{1,2}[/-]\d{1,2}[/-]\d{4}\s+\d{1,2}:\d{2})',  # 9/10/2025 10:37
+    r'(?:fecha|date|FECHA)\s*:?\s*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+    r'(\d{1,2}[/-]\d{1,2}[/-]\d{4})',  # 9/10/2025
+    r'(\d{1,2}[/-]\d{1,2}[/-]\d{2})',  # 9/10/25
+    r'(\d{1,2}\s+(?:de\s+)?(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)\s+(?:de\s+)?\d{4})'
+]
+
+# Buscar NIF/CIF/NIT (mejorado para facturas colombianas)
+NIF_PATTERNS = [
+    r'\b([A-Z]\d{7}[A-Z0-9]|\d{8}[A-Z])\b',  # Formato español
+    r'NIT\s*:?\s*(\d{1,3}-\d{1,3})',  # Formato colombiano NIT: 901-2
+    r'NIT\s*:?\s*(\d{6,12})',  # NIT sin guiones
+    r'(\d{1,3}-\d{1,3})\s*(?:NIT|nit)',  # NIT al final
+]
+
+# Buscar total (mejorado para PESOS COLOMBIANOS con $)
+TOTAL_PATTERNS = [
+    r'(?:total|TOTAL|amount|IMPORTE)\s*:?\s*[$€]?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',
+    r'\$\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # $3,000 o $3.000
+    r'(\d{1,3}(?:[.,]\d{3})+)\s*(?:COP|cop|pesos)?',  # 3,000 o 3.000
+    r'TOTAL\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # KFC format
+    r'(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})\s*[$€]?\s*(?:total|TOTAL)?',
+    r'Total\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # Case sensitive
+]
+
+# Buscar IVA/Tax (mejorado para facturas colombianas)
+TAX_PATTERNS = [
+    r'(?:IVA|VAT|tax)\s*(?:\d{1,2}%)?\s*:?\s*€?\s*(\d{1,3}(?:[.,]\d{3})*[.,]\d{2})',
+    r'IVA\s*19%\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',  # KFC format
+    r'IVA\s*:?\s*\$?\s*(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})',
+    r'(\d{1,3}(?:[.,]\d{3})*[.,]?\d{0,2})\s*\$?\s*(?:IVA|VAT)',
+]
+
+# Buscar EMAIL
+EMAIL_PATTERNS = [
+    r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
+    r'(?:email|correo|e-mail|EMAIL)\s*:?\s*([A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,})',
+]
+
+# Buscar CLIENTE (puede aparecer con etiqueta)
+CLIENT_PATTERNS = [
+    r'(?:cliente|client|CLIENTE)\s*:?\s*\d+\s*\n?\s*([A-Z][A-Za-z\s]{3,50})',
+    r'(?:cliente|client|CLIENTE)\s*:?\s*([A-Z][A-Za-z\s]{3,50})',
+    r'CLIENTE\s*:\s*\d+\s*\n([^\n]{5,50})',
+]
+
+VENDOR_EXCLUDED_KEYWORDS = ['factura', 'invoice', 'fecha', 'date', 'cliente', 'tel', 'email', 'cif', 'nif']
+VENDOR_COMPANY_MARKERS = ['SL', 'SA', 'S.L.', 'S.A.', 'SRL', 'LTDA']
+CLIENT_EXCLUDED_KEYWORDS = ['factura', 'fecha', 'total', 'cif', 'nif']
+
+
+def _compile(patterns, flags=re.IGNORECASE):
+    return [re.compile(pattern, flags) for pattern in patterns]
+
+
+@lru_cache(maxsize=4096)
+def parse_amount(amount_str):
+    """
+    Normaliza un importe en texto a float
+    Pesos colombianos: punto como separador de miles y coma como decimal,
+    aunque también puede ser al revés según la región
+    """
+    amount_str = amount_str.replace(' ', '').replace('$', '').strip()
+
+    if '.' in amount_str and ',' in amount_str:
+        # Si tiene ambos, el último es el decimal
+        if amount_str.rfind('.') > amount_str.rfind(','):
+            # punto es decimal: 1,000.50
+            amount_str = amount_str.replace(',', '')
+        else:
+            # coma es decimal: 1.000,50
+            amount_str = amount_str.replace('.', '').replace(',', '.')
+    elif '.' in amount_str:
+        # Solo punto: puede ser miles o decimal
+        parts = amount_str.split('.')
+        if len(parts) == 2 and len(parts[1]) == 3:
+            # Es separador de miles: 3.000 -> 3000
+            amount_str = amount_str.replace('.', '')
+        # Si tiene 2 dígitos después del punto, es decimal
+    elif ',' in amount_str:
+        # Solo coma: puede ser miles o decimal
+        parts = amount_str.split(',')
+        if len(parts) == 2 and len(parts[1]) == 3:
+            # Es separador de miles: 3,000 -> 3000
+            amount_str = amount_str.replace(',', '')
+        else:
+            # Es decimal
+            amount_str = amount_str.replace(',', '.')
+
+    return float(amount_str)
+
+
+class InvoiceExtractor:
+    """
+    Extractor de campos de facturas con los patrones precompilados
+    Similar a Amazon Textract pero personalizado para facturas españolas
+    """
+
+    def __init__(self):
+        self.invoice_patterns = _compile(INVOICE_PATTERNS)
+        self.date_patterns = _compile(DATE_PATTERNS)
+        self.nif_patterns = _compile(NIF_PATTERNS)
+        self.total_patterns = _compile(TOTAL_PATTERNS)
+        self.tax_patterns = _compile(TAX_PATTERNS)
+        self.email_patterns = _compile(EMAIL_PATTERNS)
+        self.client_patterns = _compile(CLIENT_PATTERNS, re.IGNORECASE | re.MULTILINE)
+
+        # Filtros rápidos: si la palabra clave no aparece, ningún patrón de
+        # la familia puede encontrar nada
+        self.tax_keyword = re.compile(r'IVA|VAT|tax', re.IGNORECASE)
+        self.client_keyword = re.compile(r'client', re.IGNORECASE)
+
+    @staticmethod
+    def _first_match(patterns, text):
+        """Primer match del primer patrón (en orden de prioridad) que encuentre algo"""
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                return match
+        return None
+
+    def find_invoice_number(self, text):
+        match = self._first_match(self.invoice_patterns, text)
+        if not match:
+            return None
+        if match.lastindex:
+            return match.group(1).strip()
+        return match.group(0).strip()
+
+    def find_date(self, text):
+        match = self._first_match(self.date_patterns, text)
+        return match.group(1).strip() if match else None
+
+    def find_nif(self, text):
+        match = self._first_match(self.nif_patterns, text)
+        return match.group(1) if match else None
+
+    def find_amounts(self, text):
+        """Todos los importes plausibles que encuentran los patrones de total"""
+        found_amounts = []
+        for pattern in self.total_patterns:
+            for match in pattern.finditer(text):
+                try:
+                    amount = parse_amount(match.group(1))
+                    if 1 <= amount <= 999999999:  # Rango razonable para pesos colombianos
+                        found_amounts.append(amount)
+                except ValueError:
+                    continue
+        return found_amounts
+
+    def find_total(self, text):
+        # El total suele ser el mayor valor
+        found_amounts = self.find_amounts(text)
+        return max(found_amounts) if found_amounts else None
+
+    def find_tax(self, text):
+        # Todos los patrones de IVA necesitan alguna de estas palabras
+        if not self.tax_keyword.search(text):
+            return None
+        match = self._first_match(self.tax_patterns, text)
+        if not match:
+            return None
+        return float(match.group(1).replace(',', '.').replace('.', '', match.group(1).count('.')-1))
+
+    def find_email(self, text):
+        if '@' not in text:
+            return None
+        match = self._first_match(self.email_patterns, text)
+        if not match:
+            return None
+        if match.lastindex:
+            return match.group(1).strip().lower()
+        return match.group(0).strip().lower()
+
+    def find_client(self, text, lines):
+        # Todos los patrones de cliente necesitan la palabra 'client(e)'
+        if self.client_keyword.search(text):
+            for pattern in self.client_patterns:
+                match = pattern.search(text)
+                if match:
+                    client = match.group(1).strip()
+                    # Limpiar el nombre del cliente
+                    if len(client) > 3 and not any(x in client.lower() for x in CLIENT_EXCLUDED_KEYWORDS):
+                        return client
+
+        # Si no se encontró cliente con patrón, buscar después de "CLIENTE:"
+        for i, line in enumerate(lines):
+            if 'cliente' in line.lower() and ':' in line:
+                # Buscar en las siguientes líneas
+                for j in range(i+1, min(i+4, len(lines))):
+                    candidate = lines[j].strip()
+                    if len(candidate) > 3 and not candidate.isdigit():
+                        return candidate
+        return None
+
+    def find_vendor(self, lines):
+        # Buscar nombre del vendedor/proveedor (primeras líneas no vacías)
+        for line in lines[:10]:
+            line = line.strip()
+            if line and len(line) > 5 and not any(keyword in line.lower() for keyword in VENDOR_EXCLUDED_KEYWORDS):
+                # Buscar líneas que parezcan nombres de empresa
+                if any(x in line.upper() for x in VENDOR_COMPANY_MARKERS) or line[0].isupper():
+                    return line
+        return None
+
+    def extract(self, text):
+        """
+        Extrae datos estructurados de la factura
+        Similar a Amazon Textract pero personalizado para facturas españolas
+        """
+        data = {
+            'raw_text': text,
+            'invoice_number': None,
+            'date': None,
+            'total_amount': None,
+            'currency': 'COP',  # Por defecto pesos colombianos
+            'subtotal': None,
+            'tax': None,
+            'nif_cif': None,
+            'vendor_name': None,
+            'client_name': None,
+            'email': None,
+            'items': [],
+            'confidence': 0
+        }
+
+        lines = text.split('\n')
+
+        data['invoice_number'] = self.find_invoice_number(text)
+        data['date'] = self.find_date(text)
+        data['nif_cif'] = self.find_nif(text)
+
+        total = self.find_total(text)
+        if total is not None:
+            data['total_amount'] = total
+            data['currency'] = 'COP'  # Pesos colombianos
+
+        data['tax'] = self.find_tax(text)
+        data['email'] = self.find_email(text)
+        data['client_name'] = self.find_client(text, lines)
+        data['vendor_name'] = self.find_vendor(lines)
+
+        data['confidence'] = self.confidence(data)
+        return data
+
+    @staticmethod
+    def confidence(data):
+        """Confianza basada en los datos encontrados"""
+        found_fields = sum([
+            1 if data['invoice_number'] else 0,
+            1 if data['date'] else 0,
+            1 if data['total_amount'] else 0,
+            1 if data['nif_cif'] else 0,
+            1 if data['vendor_name'] else 0,
+            1 if data['client_name'] else 0,
+            1 if data['email'] else 0,
+        ])
+        return (found_fields / 7) * 100
+
+    def extract_many(self, texts, workers=1, chunksize=256, return_exceptions=False):
+        """
+        Extrae los campos de muchos textos (p. ej. al re-extraer textos guardados)
+        Con workers > 1 reparte el trabajo entre procesos; devuelve un iterador
+        en el mismo orden que `texts`. Con `return_exceptions` un texto que
+        falla devuelve la excepción en su lugar en vez de cortar el iterador
+        """
+        if workers <= 1:
+            if return_exceptions:
+                return (_call_or_error(self.extract, text) for text in texts)
+            return map(self.extract, texts)
+        return _iter_pool(texts, workers, chunksize, return_exceptions)
+
+
+# Extractor compartido: los patrones se compilan una sola vez al importar
+default_extractor = InvoiceExtractor()
+
+
+def extract_invoice_data(text):
+    """
+    Extrae datos estructurados de la factura
+    Similar a Amazon Textract pero personalizado para facturas españolas
+    """
+    return default_extractor.extract(text)
+
+
+def _call_or_error(extract, text):
+    try:
+        return extract(text)
+    except Exception as e:
+        return e
+
+
+def _extract_or_error(text):
+    return _call_or_error(extract_invoice_data, text)
+
+
+def _iter_pool(texts, workers, chunksize, return_exceptions=False):
+    func = _extract_or_error if return_exceptions else extract_invoice_data
+    with Pool(processes=workers) as pool:
+        yield from pool.imap(func, texts, chunksize=chunksize)
@@ -0,0 +1,69 @@
+"""
+Configuración de gunicorn para producción
+
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Cada worker es un proceso con su propio pool de OCR (OCR_MAX_WORKERS hilos,
+cada uno con un Tesseract de un solo hilo: OMP_THREAD_LIMIT=1). El número de
+workers y el tamaño de su pool se reparten los núcleos de la máquina para no
+lanzar más procesos de tesseract que núcleos.
+
+La cola de /api/jobs está en sqlite (jobs.py), así que cualquier worker
+responde a la consulta de un trabajo y los trabajos sobreviven al reciclado.
+"""
+import os
+
+cores = os.cpu_count() or 1
+
+# Workers (procesos) y núcleos de OCR por worker
+workers = int(os.environ.get('GUNICORN_WORKERS', 0)) or max(1, cores // 4)
+ocr_threads = max(1, cores // workers)
+
+# La app lee esto al crear el pool de OCR en cada worker
+os.environ.setdefault('OCR_MAX_WORKERS', str(ocr_threads))
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+os.environ.setdefault('FLASK_ENV', 'production')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Hilos por worker: peticiones atendidas a la vez (comparten el pool de OCR)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Una factura puede tardar hasta REQUEST_DEADLINE; dar margen antes de matar el worker
+timeout = int(float(os.environ.get('REQUEST_DEADLINE', 60))) + 30
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclar workers de vez en cuando para acotar la memoria de OpenCV/Tesseract
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+# Sin preload: los pools de hilos y los motores de Tesseract no sobreviven a un fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Precalentar OpenCV y Tesseract antes de que el worker acepte peticiones"""
+    import app
+
+    try:
+        app.warmup()
+    except Exception as e:
+        worker.log.warning(f"Precalentamiento fallido: {e}")
+
+
+def worker_exit(server, worker):
+    """
+    Guardar el historial de configuraciones pendiente y devolver a la cola
+    los trabajos en marcha antes de que el worker salga
+    """
+    import app
+
+    if app.ocr_engine is not None:
+        app.ocr_engine.stats.flush()
+    if app.job_manager is not None:
+        app.job_manager.shutdown()
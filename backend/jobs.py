@@ -0,0 +1,218 @@
+"""
+Cola de trabajos asíncronos para el procesamiento de facturas
+
+Los trabajos (archivo, estado y resultado) se guardan en una tabla sqlite
+bajo UPLOAD_FOLDER que comparten todos los workers de gunicorn: cualquiera
+puede encolar, cualquiera responde a la consulta de un trabajo y los hilos
+de cada proceso van tomando los pendientes. Si la cola está llena se
+rechazan (QueueFullError) para que el cliente reintente más tarde en lugar
+de acumular trabajo que el servidor no puede atender.
+
+Un trabajo que estaba en marcha en un worker que murió (o que gunicorn
+recicló) vuelve a la cola; tras MAX_ATTEMPTS intentos se marca como error.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from cache import sqlite_connection
+from shared_image import process_alive
+
+# Segundos entre consultas de la cola cuando no hay trabajo (al encolar en
+# el mismo proceso los hilos se despiertan antes)
+POLL_INTERVAL = 0.5
+
+# Cada cuánto se buscan trabajos de workers muertos y resultados caducados
+MAINTENANCE_INTERVAL = 30
+
+# Intentos de un trabajo cuyo worker muere antes de darlo por fallido
+MAX_ATTEMPTS = 2
+
+PUBLIC_COLUMNS = ('id', 'status', 'filename', 'created_at', 'started_at', 'finished_at', 'result', 'error')
+
+
+class QueueFullError(Exception):
+    """No hay sitio en la cola para los trabajos enviados"""
+
+
+class JobManager:
+    """Cola acotada de trabajos en sqlite con workers propios y resultados consultables"""
+
+    def __init__(self, handler, path, workers=2, max_queue=100, result_ttl=3600):
+        self.handler = handler
+        self.path = path
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._maintained_at = 0.0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with sqlite_connection(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT, '
+                'created_at REAL NOT NULL, started_at REAL, finished_at REAL, '
+                'data BLOB, options TEXT, result TEXT, error TEXT, '
+                'owner INTEGER, attempts INTEGER NOT NULL DEFAULT 0)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit_many(self, payloads):
+        """
+        Encola varios trabajos a la vez (todos o ninguno)
+        `payloads` es una lista de (nombre_archivo, bytes, opciones para el
+        handler); las opciones deben poder guardarse como JSON
+        """
+        now = time.time()
+        jobs = [
+            {'id': uuid.uuid4().hex, 'status': 'queued', 'filename': filename, 'created_at': now,
+             'started_at': None, 'finished_at': None, 'result': None, 'error': None}
+            for filename, _, _ in payloads
+        ]
+        with sqlite_connection(self.path) as conn:
+            # Contar y encolar en la misma transacción de escritura: los
+            # demás workers no pueden colarse entre medias
+            conn.execute('BEGIN IMMEDIATE')
+            self._purge_finished(conn)
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued + len(payloads) > self.max_queue:
+                raise QueueFullError(f'Cola llena ({queued}/{self.max_queue} trabajos pendientes)')
+            conn.executemany(
+                'INSERT INTO jobs (id, status, filename, created_at, data, options) VALUES (?, ?, ?, ?, ?, ?)',
+                [(job['id'], job['status'], job['filename'], now, data, json.dumps(options))
+                 for job, (_, data, options) in zip(jobs, payloads)]
+            )
+        self._wakeup.set()
+        return jobs
+
+    def submit(self, filename, data, **options):
+        """Encola un trabajo y devuelve su descripción"""
+        return self.submit_many([(filename, data, options)])[0]
+
+    def get(self, job_id):
+        """Estado (y resultado, si ya terminó) de un trabajo"""
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(PUBLIC_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(PUBLIC_COLUMNS, row))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def stats(self):
+        with sqlite_connection(self.path) as conn:
+            by_status = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {
+            'queued': by_status.get('queued', 0),
+            'max_queue': self.max_queue,
+            'workers': len(self._threads),
+            'jobs': by_status,
+        }
+
+    def shutdown(self):
+        """Deja de tomar trabajos y devuelve a la cola los que este proceso tenía en marcha"""
+        self._stopping.set()
+        self._wakeup.set()
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL, attempts = attempts - 1 "
+                "WHERE status = 'running' AND owner = ?", (os.getpid(),)
+            )
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"⚠️  No se pudo leer la cola de trabajos: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            job_id, data, options = job
+            try:
+                result = self.handler(data, **options)
+                update = ('done', json.dumps(result), None)
+            except Exception as e:
+                print(f"❌ Trabajo {job_id} falló: {e}")
+                update = ('error', None, str(e))
+            finally:
+                # Soltar los bytes de la imagen cuanto antes
+                del data
+
+            # Solo si sigue siendo nuestro (al parar el worker vuelve a la cola)
+            try:
+                with sqlite_connection(self.path) as conn:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, data = NULL '
+                        "WHERE id = ? AND status = 'running' AND owner = ?",
+                        update + (time.time(), job_id, os.getpid())
+                    )
+            except sqlite3.Error as e:
+                print(f"❌ No se pudo guardar el resultado del trabajo {job_id}: {e}")
+
+    def _claim(self):
+        """Toma el trabajo pendiente más antiguo; devuelve (id, bytes, opciones) o None"""
+        with sqlite_connection(self.path) as conn:
+            maintenance = time.monotonic() - self._maintained_at >= MAINTENANCE_INTERVAL
+            # Sin nada pendiente no hace falta el lock de escritura
+            if not maintenance and conn.execute(
+                "SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1"
+            ).fetchone() is None:
+                return None
+            conn.execute('BEGIN IMMEDIATE')
+            if maintenance:
+                self._maintained_at = time.monotonic()
+                self._requeue_orphans(conn)
+                self._purge_finished(conn)
+            row = conn.execute(
+                "SELECT id, data, options FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner = ?, attempts = attempts + 1 "
+                'WHERE id = ?', (time.time(), os.getpid(), row[0])
+            )
+        return row[0], row[1], json.loads(row[2])
+
+    def _requeue_orphans(self, conn):
+        """Devuelve a la cola los trabajos en marcha de procesos que ya no existen"""
+        running = conn.execute("SELECT id, owner, attempts FROM jobs WHERE status = 'running'").fetchall()
+        for job_id, owner, attempts in running:
+            if owner == os.getpid() or process_alive(owner):
+                continue
+            if attempts >= MAX_ATTEMPTS:
+                print(f"❌ Trabajo {job_id}: el worker terminó inesperadamente {attempts} veces")
+                conn.execute(
+                    "UPDATE jobs SET status = 'error', error = ?, finished_at = ?, data = NULL WHERE id = ?",
+                    ('El worker que procesaba el trabajo terminó inesperadamente', time.time(), job_id)
+                )
+            else:
+                print(f"🔁 Trabajo {job_id}: el worker {owner} terminó, vuelve a la cola")
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL WHERE id = ?", (job_id,)
+                )
+
+    def _purge_finished(self, conn):
+        """Olvida los trabajos terminados hace más de `result_ttl` segundos"""
+        conn.execute(
+            'DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+            (time.time() - self.result_ttl,)
+        )
@@ -0,0 +1,125 @@
+"""
+Detección de regiones de texto para el OCR por regiones
+
+En lugar de pasar a Tesseract la página entera (márgenes, logos, papel en
+blanco) se buscan los bloques de texto sobre una copia reducida de la imagen
+preprocesada:
+- las palabras de una misma línea se unen con un cierre horizontal
+- las líneas cercanas se agrupan en bloques con una dilatación vertical
+- se descartan el ruido y las zonas casi macizas (logos, sellos, fotos)
+
+Cada región lleva su tipo: 'line' (una sola línea: totales, fechas) o
+'block' (varias líneas: tablas de conceptos, direcciones), que decide el psm
+con el que se lee.
+"""
+import cv2
+import numpy as np
+
+from preprocessing import estimate_text_height
+
+# Lado máximo de la copia reducida sobre la que se buscan las regiones
+LAYOUT_MAX_SIDE = 1200
+
+# Si las regiones cubren más que esto de la página no compensa recortar
+MAX_COVERAGE = 0.85
+
+
+def find_text_regions(image, text_height=None, max_side=LAYOUT_MAX_SIDE, max_fill=0.6, max_coverage=MAX_COVERAGE):
+    """
+    Regiones de texto de una imagen preprocesada (texto oscuro sobre fondo claro)
+
+    `text_height` es la altura de carácter en píxeles de `image` si ya se
+    conoce (la que estimó el reescalado sobre la imagen original, más fiable
+    que estimarla sobre una imagen binarizada con ruido). Devuelve una lista de diccionarios {'box': (x, y, w, h), 'kind': 'line'|'block',
+    'lines': n} en coordenadas de `image` y en orden de lectura, o None si no
+    se encuentra texto o las regiones cubren casi toda la página (en ese caso
+    conviene leer la página entera).
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    ratio = min(1.0, max_side / max(h, w))
+    small = cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA) if ratio < 1.0 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    # Altura de carácter en la copia reducida: escala de los kernels
+    if text_height:
+        text_height *= ratio
+    else:
+        text_height = estimate_text_height(small, max_side=max(small.shape)) or small.shape[0] / 80
+    text_height = max(2.0, text_height)
+
+    # Quitar zonas macizas (bordes oscuros, sombras, logos): sobreviven a una
+    # apertura más gruesa que un trazo, el texto no. Con mucho ruido la altura
+    # de carácter sale baja, de ahí el mínimo (~0.6% del lado mayor)
+    solid_size = max(int(max(small.shape) * 0.006), int(text_height * 0.8), 3)
+    solid_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (solid_size, solid_size))
+    solid = cv2.dilate(cv2.morphologyEx(ink, cv2.MORPH_OPEN, solid_kernel), solid_kernel)
+    ink = cv2.subtract(ink, solid)
+
+    # Quitar motas: componentes mucho más pequeñas que un signo de puntuación
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    specks = stats[:, cv2.CC_STAT_AREA] < (text_height * 0.15) ** 2
+    specks[0] = False
+    if specks.any():
+        ink[specks[labels]] = 0
+
+    # Líneas: unir caracteres y palabras separadas por unos pocos espacios
+    line_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, int(text_height * 4)), max(1, int(text_height * 0.3))))
+    line_mask = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, line_kernel)
+    lines = _boxes(line_mask, min_height=text_height * 0.5, min_width=text_height)
+
+    # Bloques: unir líneas separadas por menos de una línea en blanco
+    block_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, int(text_height * 2)), max(3, int(text_height * 1.5))))
+    block_mask = cv2.dilate(line_mask, block_kernel)
+    blocks = _boxes(block_mask, min_height=text_height * 0.5, min_width=text_height)
+
+    regions = []
+    for bx, by, bw, bh in blocks:
+        inside = [
+            box for box in lines
+            if bx <= box[0] + box[2] / 2 <= bx + bw and by <= box[1] + box[3] / 2 <= by + bh
+        ]
+        if not inside:
+            continue
+        # Zonas casi macizas: logos, sellos o fotos, no texto
+        fill = cv2.countNonZero(ink[by:by + bh, bx:bx + bw]) / float(bw * bh)
+        if fill > max_fill:
+            continue
+        regions.append({
+            'box': _to_full(bx, by, bw, bh, ratio, text_height, w, h),
+            'kind': 'line' if len(inside) == 1 else 'block',
+            'lines': len(inside),
+        })
+
+    if not regions:
+        return None
+    covered = sum(r['box'][2] * r['box'][3] for r in regions)
+    if covered > max_coverage * w * h:
+        return None
+
+    # Orden de lectura: de arriba abajo y, en la misma franja, de izquierda a derecha
+    band = max(1, int(text_height / ratio))
+    regions.sort(key=lambda r: (r['box'][1] // band, r['box'][0]))
+    return regions
+
+
+def _boxes(mask, min_height, min_width):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(contour) for contour in contours]
+    return [box for box in boxes if box[3] >= min_height and box[2] >= min_width]
+
+
+def _to_full(x, y, w, h, ratio, text_height, width, height):
+    """Caja de la copia reducida a la imagen completa, con margen de medio carácter"""
+    pad = text_height * 0.5
+    x0 = max(0, int((x - pad) / ratio))
+    y0 = max(0, int((y - pad) / ratio))
+    x1 = min(width, int(np.ceil((x + w + pad) / ratio)))
+    y1 = min(height, int(np.ceil((y + h + pad) / ratio)))
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def crop(image, box):
+    """Recorte contiguo de una región (tesserocr necesita memoria contigua)"""
+    x, y, w, h = box
+    return np.ascontiguousarray(image[y:y + h, x:x + w])
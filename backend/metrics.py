@@ -0,0 +1,185 @@
+"""
+Métricas del servicio en formato Prometheus
+
+Contadores e histogramas con etiquetas, sin dependencias externas. El
+endpoint /metrics devuelve `render()`. Con gunicorn cada worker lleva sus
+propias métricas (Prometheus las agrega por instancia).
+
+Además, Timings mide las etapas de una petición concreta: alimenta los
+histogramas y puede devolverse en la respuesta (bloque `timings`).
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Buckets en segundos: desde etapas rápidas (decodificar) hasta OCR de páginas grandes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PIXEL_BUCKETS = (250_000, 500_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000, 16_000_000, 32_000_000, 64_000_000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monótono con etiquetas (el nombre debe acabar en _total)"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """Histograma acumulado con etiquetas (buckets fijos)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # etiquetas -> [cuentas por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*entry[0]], entry[1], entry[2]) for key, entry in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, ('le', _format_value(bound)))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labels, key)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Texto de exposición de Prometheus (versión 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'invoice_ocr_requests_total', 'Peticiones atendidas por endpoint y código de estado', ('endpoint', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'invoice_ocr_request_seconds', 'Duración de las peticiones por endpoint', ('endpoint',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'invoice_ocr_stage_seconds', 'Duración de cada etapa del pipeline (decode, preprocess, ocr, extract...)', ('stage',)))
+PREPROCESS_STAGE_SECONDS = REGISTRY.register(Histogram(
+    'invoice_ocr_preprocess_stage_seconds', 'Duración de cada etapa del perfil de preprocesamiento', ('profile', 'stage')))
+CONFIG_SECONDS = REGISTRY.register(Histogram(
+    'invoice_ocr_config_seconds', 'Duración de cada pasada de Tesseract por configuración', ('config',)))
+CONFIG_RUNS = REGISTRY.register(Counter(
+    'invoice_ocr_config_runs_total', 'Pasadas de Tesseract por configuración y resultado (ok, timeout, error, skipped)',
+    ('config', 'outcome')))
+SCORING_SECONDS = REGISTRY.register(Histogram(
+    'invoice_ocr_scoring_seconds', 'Tiempo de puntuar el resultado de una configuración'))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'invoice_ocr_cache_lookups_total', 'Consultas a las cachés por nivel (memory, disk, miss)', ('cache', 'result')))
+TIMEOUTS = REGISTRY.register(Counter(
+    'invoice_ocr_timeouts_total', 'Peticiones que agotaron su presupuesto de tiempo', ('stage',)))
+PREPROCESS_PROFILES = REGISTRY.register(Counter(
+    'invoice_ocr_preprocess_profiles_total', 'Imágenes preprocesadas por perfil (elegido por el triaje o configurado)',
+    ('profile',)))
+IMAGE_PIXELS = REGISTRY.register(Histogram(
+    'invoice_ocr_image_pixels', 'Píxeles de las imágenes recibidas y tras preprocesar', ('phase',), buckets=PIXEL_BUCKETS))
+
+
+class Timings:
+    """Tiempos de las etapas de una petición (en ms), que también van a los histogramas"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages_ms = {}
+        self.configs_ms = None  # ms de cada configuración de Tesseract, si hubo OCR
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        # Las páginas de un PDF suman su tiempo en la misma etapa desde varios hilos
+        with self._lock:
+            self.stages_ms[name] = round(self.stages_ms.get(name, 0) + seconds * 1000, 2)
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+    def as_dict(self):
+        with self._lock:
+            timings = dict(self.stages_ms)
+        timings['total'] = round((time.perf_counter() - self.started_at) * 1000, 2)
+        if self.configs_ms:
+            timings['ocr_configs'] = dict(self.configs_ms)
+        return timings
@@ -0,0 +1,181 @@
+"""
+Backends de Tesseract para el motor de OCR
+
+- tesserocr: usa la API C de Tesseract dentro del proceso. Cada hilo worker
+  mantiene su propio motor con el modelo de idioma ya cargado y recibe el
+  array de numpy directamente, sin PNG temporal.
+- pytesseract: lanza el binario tesseract en cada llamada (respaldo cuando
+  tesserocr no está instalado).
+
+Ambos devuelven el mismo diccionario que pytesseract.image_to_data con
+output_type=Output.DICT.
+"""
+import shlex
+import threading
+
+import numpy as np
+import pytesseract
+
+from shared_image import SharedImage
+
+BACKENDS = ('auto', 'tesserocr', 'pytesseract')
+
+# Columnas de la salida TSV de Tesseract
+TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text']
+
+
+def parse_tesseract_config(config):
+    """
+    Traduce una cadena de configuración estilo CLI ('--oem 1 --psm 6 -l spa -c k=v')
+    a idioma, modo de motor, modo de segmentación y variables
+    """
+    lang = 'eng'  # Mismo idioma por defecto que el binario tesseract
+    oem = 3
+    psm = 3
+    variables = {}
+
+    tokens = shlex.split(config)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token == '-l' and value:
+            lang = value
+            i += 1
+        elif token == '--oem' and value:
+            oem = int(value)
+            i += 1
+        elif token == '--psm' and value:
+            psm = int(value)
+            i += 1
+        elif token == '-c' and value and '=' in value:
+            key, val = value.split('=', 1)
+            variables[key] = val
+            i += 1
+        i += 1
+
+    return lang, oem, psm, variables
+
+
+def parse_tsv(tsv):
+    """Convierte la salida TSV de Tesseract al formato DICT de pytesseract"""
+    data = {column: [] for column in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        cells = row.split('\t')
+        if len(cells) < len(TSV_COLUMNS) - 1 or cells[0] == 'level':
+            continue
+        # Las filas sin palabra no llevan la columna de texto
+        cells += [''] * (len(TSV_COLUMNS) - len(cells))
+        for column, cell in zip(TSV_COLUMNS, cells):
+            if column == 'text':
+                data[column].append(cell)
+            elif column == 'conf':
+                data[column].append(float(cell))
+            else:
+                data[column].append(int(cell))
+    return data
+
+
+class PytesseractBackend:
+    """Lanza un proceso de tesseract por llamada"""
+
+    name = 'pytesseract'
+
+    # tesseract lee la imagen de un archivo: el motor puede compartir uno
+    # entre todas las configuraciones del barrido (ver shared_image.py)
+    shares_images = True
+
+    def image_to_data(self, image, config, timeout=0):
+        if isinstance(image, SharedImage):
+            return self._image_to_data(image.path, config, timeout)
+        # Sin imagen compartida se vuelca igualmente sin comprimir (más rápido que el PNG de pytesseract)
+        try:
+            shared = SharedImage(image)
+        except OSError:
+            # Sin espacio para el volcado: pytesseract escribe su PNG temporal
+            return self._image_to_data(image, config, timeout)
+        with shared:
+            return self._image_to_data(shared.path, config, timeout)
+
+    def _image_to_data(self, image, config, timeout):
+        # `image` es la ruta del volcado o el array; pytesseract mata el
+        # proceso de tesseract si se supera el timeout
+        return pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT, timeout=timeout)
+
+
+class TesserocrBackend:
+    """
+    Motor de Tesseract persistente dentro del proceso
+
+    Se crea un motor por hilo y por combinación de idioma, modo de motor y
+    variables, y se reutiliza en todas las peticiones que atiende ese hilo.
+    """
+
+    name = 'tesserocr'
+
+    # Recibe el array directamente, sin archivos
+    shares_images = False
+
+    def __init__(self, tesserocr_module):
+        self._tesserocr = tesserocr_module
+        self._local = threading.local()
+
+    def _get_api(self, lang, oem, variables):
+        apis = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = {}
+
+        key = (lang, oem, tuple(sorted(variables.items())))
+        api = apis.get(key)
+        if api is None:
+            api = self._tesserocr.PyTessBaseAPI(lang=lang, oem=oem)
+            for name, value in variables.items():
+                api.SetVariable(name, value)
+            apis[key] = api
+        return api
+
+    def image_to_data(self, image, config, timeout=0):
+        lang, oem, psm, variables = parse_tesseract_config(config)
+        api = self._get_api(lang, oem, variables)
+
+        # Pasar los píxeles directamente (Tesseract espera RGB, OpenCV usa BGR)
+        if image.ndim == 3:
+            image = image[:, :, ::-1]
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+
+        try:
+            api.SetPageSegMode(psm)
+            api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+            timeout_ms = max(1, int(timeout * 1000)) if timeout else 0
+            if not api.Recognize(timeout=timeout_ms):
+                if timeout:
+                    raise RuntimeError('Tesseract process timeout')
+                raise RuntimeError('Tesseract recognition failed')
+            return parse_tsv(api.GetTSVText(0))
+        finally:
+            # Liberar la imagen y los resultados, el modelo queda cargado
+            api.Clear()
+
+
+def get_backend(name='auto'):
+    """
+    Devuelve el backend de Tesseract pedido
+    Con 'auto' usa tesserocr si está instalado y si no pytesseract
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de OCR desconocido: {name}")
+
+    if name in ('auto', 'tesserocr'):
+        try:
+            import tesserocr
+        except ImportError:
+            if name == 'tesserocr':
+                raise
+            print("⚠️  tesserocr no está instalado, usando pytesseract")
+        else:
+            return TesserocrBackend(tesserocr)
+
+    return PytesseractBackend()
@@ -0,0 +1,636 @@
+"""
+Motor de OCR para facturas
+Ejecuta el barrido de configuraciones de Tesseract en un pool acotado de workers
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows: el lock del historial solo es entre hilos
+    fcntl = None
+
+from deadline import DeadlineExceeded
+from extraction import extract_invoice_data
+from layout import crop, find_text_regions
+from metrics import CONFIG_RUNS, CONFIG_SECONDS, SCORING_SECONDS
+from ocr_backends import PytesseractBackend, get_backend
+from shared_image import SharedImage, remove_stale
+from targeted import best_reading, find_anchors, needs_retry, patch_value, value_box, FIELD_ANCHORS
+
+# Configuraciones OPTIMIZADAS de OCR (solo las mejores)
+OCR_CONFIGS = [
+    # Configuraciones básicas más efectivas
+    r'--oem 1 --psm 3 -l spa',  # Automático
+    r'--oem 1 --psm 6 -l spa',  # Bloque uniforme (mejor para facturas)
+    r'--oem 1 --psm 4 -l spa',  # Columna única
+    r'--oem 1 --psm 8 -l spa',  # Palabra única
+
+    # Configuraciones agresivas más efectivas
+    r'--oem 3 --psm 3 -l spa',  # OEM 3 (más agresivo)
+    r'--oem 3 --psm 6 -l spa',  # OEM 3 + bloque uniforme
+    r'--oem 3 --psm 4 -l spa',  # OEM 3 + columna única
+
+    # Sin idioma específico (más flexible)
+    r'--oem 1 --psm 3',  # Sin idioma
+    r'--oem 3 --psm 3',  # OEM 3 sin idioma
+    r'--oem 1 --psm 6',  # Sin idioma + bloque
+    r'--oem 3 --psm 6',  # OEM 3 sin idioma + bloque
+]
+
+# Modos de búsqueda de la mejor configuración
+SEARCH_MODES = ('exhaustive', 'adaptive', 'regions', 'targeted')
+
+# OCR por regiones: psm según el tipo de región (layout.py)
+REGION_CONFIGS = {
+    'line': r'--oem 1 --psm 7 -l spa',  # Una sola línea (totales, fechas)
+    'block': r'--oem 1 --psm 6 -l spa',  # Bloque uniforme (conceptos, direcciones)
+    'page': r'--oem 1 --psm 3 -l spa',  # Sin regiones útiles: página completa
+}
+
+# El historial de configuraciones se escribe cada tantas búsquedas o segundos
+# (y al terminar el proceso), no en cada petición
+STATS_FLUSH_RECORDS = 50
+STATS_FLUSH_SECONDS = 60
+
+# Palabras clave que suelen aparecer en facturas
+INVOICE_KEYWORDS = ['factura', 'total', 'iva', 'fecha', 'nit', 'cif', 'cliente', 'proveedor']
+
+
+def score_ocr_result(text, data):
+    """
+    Sistema de scoring INTELIGENTE para comparar configuraciones
+    Devuelve el score combinado y el detalle de cada componente
+    """
+    # Calcular confianza promedio
+    confidences = [int(conf) for conf in data['conf'] if conf != '-1']
+    avg_conf = sum(confidences) / len(confidences) if confidences else 0
+
+    text_length = len(text.strip())
+    text_quality = text_length * 0.1
+
+    # Bonus por palabras clave de facturas
+    keyword_bonus = sum([1 for keyword in INVOICE_KEYWORDS if keyword.lower() in text.lower()]) * 5
+
+    # Bonus por números (importante en facturas)
+    numbers = len(re.findall(r'\d+', text))
+    number_bonus = numbers * 0.5
+
+    # Bonus por símbolos de moneda
+    currency_bonus = len(re.findall(r'[$€]', text)) * 3
+
+    # Penalización por texto muy corto o muy largo
+    length_penalty = 0
+    if text_length < 50:
+        length_penalty = -10
+    elif text_length > 2000:
+        length_penalty = -5
+
+    combined_score = avg_conf + text_quality + keyword_bonus + number_bonus + currency_bonus + length_penalty
+
+    return combined_score, {
+        'avg_conf': avg_conf,
+        'text_length': text_length,
+        'keyword_bonus': keyword_bonus,
+        'number_bonus': number_bonus,
+        'currency_bonus': currency_bonus,
+    }
+
+
+def text_from_data(data):
+    """
+    Reconstruye el texto plano a partir de la salida de image_to_data
+    Respeta el orden bloque/párrafo/línea de Tesseract: palabras separadas
+    por espacios, líneas por salto de línea y párrafos por una línea vacía
+    """
+    paragraphs = []
+    current_par = None
+    current_line = None
+
+    for i in range(len(data['text'])):
+        word = str(data['text'][i]).strip()
+        # Solo el nivel 5 (palabra) lleva texto
+        if data['level'][i] != 5 or not word:
+            continue
+
+        par_key = (data['page_num'][i], data['block_num'][i], data['par_num'][i])
+        line_key = par_key + (data['line_num'][i],)
+
+        if par_key != current_par:
+            paragraphs.append([])
+            current_par = par_key
+            current_line = None
+        if line_key != current_line:
+            paragraphs[-1].append([])
+            current_line = line_key
+
+        paragraphs[-1][-1].append(word)
+
+    return '\n\n'.join('\n'.join(' '.join(words) for words in lines) for lines in paragraphs)
+
+
+def merge_region_data(regions):
+    """
+    Une la salida de image_to_data de varias regiones (lista de (región, datos))
+    en una sola: coordenadas trasladadas a la imagen completa y bloques
+    renumerados, para que text_from_data no junte líneas de regiones distintas
+    """
+    merged = None
+    blocks = {}
+    for number, (region, data) in enumerate(regions):
+        x, y = region['box'][:2]
+        if merged is None:
+            merged = {column: [] for column in data}
+        for i in range(len(data['text'])):
+            # La fila de nivel 1 es la página del recorte
+            if data['level'][i] == 1:
+                continue
+            for column in merged:
+                value = data[column][i]
+                if column == 'left':
+                    value += x
+                elif column == 'top':
+                    value += y
+                elif column == 'block_num':
+                    value = blocks.setdefault((number, value), len(blocks) + 1)
+                merged[column].append(value)
+    return merged
+
+
+def run_ocr(image, config, timeout=0, backend=None):
+    """
+    Ejecuta UNA sola pasada de Tesseract con la configuración dada
+    Devuelve el texto reconstruido y los datos con coordenadas de cada palabra
+    """
+    backend = backend or PytesseractBackend()
+    data = backend.image_to_data(image, config, timeout=timeout)
+    return text_from_data(data), data
+
+
+@contextmanager
+def file_lock(path):
+    """Lock exclusivo entre procesos mientras dura el bloque (sin fcntl no hace nada)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ConfigStats:
+    """
+    Historial de victorias de cada configuración de OCR
+    Se usa para probar primero las configuraciones que más suelen ganar
+
+    Los registros se acumulan en memoria y se suman al archivo por lotes:
+    al escribir se relee el archivo bajo un lock entre procesos, así que los
+    workers de gunicorn comparten el historial sin pisarse los contadores.
+    """
+
+    def __init__(self, path=None, flush_records=STATS_FLUSH_RECORDS, flush_seconds=STATS_FLUSH_SECONDS):
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._stats = self._load() if path else {}
+        self._pending = {}
+        self._pending_records = 0
+        self._flushed_at = time.monotonic()
+        if path:
+            atexit.register(self.flush)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️  No se pudo leer el historial de configuraciones: {self.path}")
+            return {}
+
+    def win_rate(self, config):
+        """Tasa de victorias suavizada (las configuraciones sin historial valen 0.5)"""
+        stats = self._stats.get(config, {})
+        return (stats.get('wins', 0) + 1) / (stats.get('runs', 0) + 2)
+
+    def order(self, configs):
+        """Ordena las configuraciones por tasa de victorias (estable ante empates)"""
+        return sorted(configs, key=lambda config: -self.win_rate(config))
+
+    def record(self, tried, winner):
+        """Registra qué configuraciones se probaron y cuál ganó"""
+        with self._lock:
+            for config in tried:
+                for counts in (self._stats, self._pending):
+                    stats = counts.setdefault(config, {'runs': 0, 'wins': 0})
+                    stats['runs'] += 1
+                    if config == winner:
+                        stats['wins'] += 1
+            self._pending_records += 1
+            due = (self._pending_records >= self.flush_records or
+                   time.monotonic() - self._flushed_at >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Suma los registros pendientes al archivo y recoge los de los demás
+        procesos; si falla la escritura se reintenta en el siguiente lote
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._pending:
+                return
+            try:
+                with file_lock(f"{self.path}.lock"):
+                    stats = self._load()
+                    for config, pending in self._pending.items():
+                        counts = stats.setdefault(config, {'runs': 0, 'wins': 0})
+                        counts['runs'] += pending['runs']
+                        counts['wins'] += pending['wins']
+                    tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(stats, f)
+                    os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️  No se pudo guardar el historial de configuraciones: {e}")
+                return
+            self._stats = stats
+            self._pending = {}
+            self._pending_records = 0
+            self._flushed_at = time.monotonic()
+
+    def snapshot(self):
+        """Copia del historial con la tasa de victorias de cada configuración"""
+        with self._lock:
+            return {
+                config: dict(stats, win_rate=self.win_rate(config))
+                for config, stats in self._stats.items()
+            }
+
+
+class OCREngine:
+    """
+    Pool acotado de workers que ejecuta las configuraciones de OCR a la vez
+
+    Tanto el proceso de tesseract (pytesseract) como la API C (tesserocr)
+    trabajan fuera del GIL, así que un pool de hilos basta para ocupar
+    todos los núcleos.
+    """
+
+    def __init__(self, max_workers=None, config_timeout=10, search_mode='exhaustive',
+                 score_threshold=150, patience=2, adaptive_batch=1, stats_path=None,
+                 backend='auto'):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.config_timeout = config_timeout
+        self.search_mode = search_mode
+        self.score_threshold = score_threshold
+        self.patience = patience
+        self.adaptive_batch = max(1, adaptive_batch)
+        self.stats = ConfigStats(stats_path)
+
+        # Evitar que cada tesseract abra sus propios hilos OpenMP y
+        # compita con el resto del pool por los mismos núcleos
+        if self.max_workers > 1:
+            os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+        # El backend se carga después de fijar OMP_THREAD_LIMIT para que
+        # tesserocr lo respete al inicializar OpenMP
+        self.backend = get_backend(backend) if isinstance(backend, str) else backend
+        print(f"🔧 Backend de OCR: {self.backend.name}")
+
+        # Con pytesseract la imagen del barrido se vuelca una sola vez a
+        # memoria compartida; se limpian los restos de workers anteriores
+        self.shared_images = getattr(self.backend, 'shares_images', False)
+        if self.shared_images:
+            removed = remove_stale()
+            if removed:
+                print(f"🧹 {removed} imágenes compartidas huérfanas borradas")
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ocr')
+
+    def _run(self, image, config, deadline=None, timings=None, config_timeout=None):
+        """
+        Una configuración con el timeout por configuración (`config_timeout`,
+        por defecto el del motor; 0 = sin límite propio), recortado a lo
+        que quede del presupuesto de la petición. Se calcula al empezar (no al
+        encolar) y si ya no queda tiempo la configuración ni se lanza.
+        Anota la duración en `timings` (config -> ms) y en las métricas.
+        """
+        timeout = self.config_timeout if config_timeout is None else config_timeout
+        if deadline is not None:
+            try:
+                deadline.check(f'el OCR ({config})')
+            except DeadlineExceeded:
+                CONFIG_RUNS.inc(config=config, outcome='skipped')
+                raise
+            timeout = deadline.timeout(timeout)
+
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = run_ocr(image, config, timeout, self.backend)
+            outcome = 'ok'
+            return result
+        except RuntimeError as e:
+            if 'timeout' in str(e).lower():
+                outcome = 'timeout'
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            CONFIG_SECONDS.observe(elapsed, config=config)
+            CONFIG_RUNS.inc(config=config, outcome=outcome)
+            if timings is not None:
+                # En el OCR por regiones una configuración se ejecuta varias veces
+                timings[config] = round(timings.get(config, 0) + elapsed * 1000, 2)
+
+    def _evaluate(self, image, configs, best, tried, deadline=None):
+        """
+        Ejecuta un grupo de configuraciones en paralelo y actualiza `best`
+
+        Los resultados se evalúan en el orden de `configs`, de modo que ante
+        un empate gana la misma configuración que en el barrido secuencial.
+        Devuelve True si alguna configuración mejoró el mejor score.
+        """
+        futures = []
+        for config in configs:
+            if isinstance(image, SharedImage):
+                # Una referencia por configuración en vuelo
+                image.acquire()
+            future = self._executor.submit(self._run, image, config, deadline, best['config_ms'])
+            if isinstance(image, SharedImage):
+                future.add_done_callback(lambda _: image.release())
+            futures.append(future)
+
+        improved = False
+        for config, future in zip(configs, futures):
+            number = OCR_CONFIGS.index(config) + 1 if config in OCR_CONFIGS else 0
+            try:
+                temp_text, temp_data = future.result()
+            except DeadlineExceeded:
+                # No llegó a ejecutarse
+                best['timed_out'] = True
+                continue
+            except RuntimeError as e:
+                best['configs_tried'] += 1
+                tried.append(config)
+                if deadline is not None and deadline.expired():
+                    best['timed_out'] = True
+                if 'timeout' in str(e).lower():
+                    print(f"  Config {number:2d}: Timeout - saltando...")
+                else:
+                    print(f"  Config {number:2d}: Error - {str(e)}")
+                continue
+            except Exception as e:
+                best['configs_tried'] += 1
+                tried.append(config)
+                print(f"  Config {number:2d}: Error - {str(e)}")
+                continue
+
+            best['configs_tried'] += 1
+            tried.append(config)
+
+            with SCORING_SECONDS.time():
+                combined_score, details = score_ocr_result(temp_text, temp_data)
+
+            print(f"  Config {number:2d}: Conf={details['avg_conf']:5.1f}%, Text={details['text_length']:4d} chars, KW={details['keyword_bonus']:2.0f}, Num={details['number_bonus']:2.0f}, $={details['currency_bonus']:2.0f}, Score={combined_score:6.1f}")
+
+            if combined_score > best['score']:
+                best.update({
+                    'text': temp_text,
+                    'data': temp_data,
+                    'config': config,
+                    'score': combined_score,
+                })
+                improved = True
+
+        return improved
+
+    def _share(self, image):
+        """
+        Imagen para varias configuraciones: volcada una vez a memoria
+        compartida si el backend lee archivos, o la propia imagen
+        """
+        if self.shared_images:
+            try:
+                return SharedImage(image)
+            except OSError as e:
+                # Sin espacio ni en memoria ni en disco: cada configuración recibe el array
+                print(f"⚠️  No se pudo compartir la imagen ({e}), se pasa el array a cada configuración")
+        return nullcontext(image)
+
+    def run(self, image, config, deadline=None, timings=None, config_timeout=None):
+        """
+        Ejecuta una única configuración con el backend del motor
+        Con `config_timeout=0` solo la limita el presupuesto de la petición
+        """
+        return self._run(image, config, deadline, timings, config_timeout)
+
+    def _search_regions(self, image, best, deadline=None, text_height=None):
+        """
+        OCR por regiones: localiza los bloques de texto y lee cada recorte en
+        paralelo con el psm de su tipo, en lugar de la página entera. Las
+        palabras se devuelven en coordenadas de la imagen completa.
+        """
+        regions = find_text_regions(image, text_height)
+        if regions is None:
+            regions = [{'box': (0, 0, image.shape[1], image.shape[0]), 'kind': 'page', 'lines': None}]
+        page_pixels = image.shape[0] * image.shape[1]
+        region_pixels = sum(region['box'][2] * region['box'][3] for region in regions)
+        print(f"🔍 OCR por regiones: {len(regions)} regiones, {region_pixels / page_pixels:.0%} de los píxeles")
+
+        futures = [
+            self._executor.submit(self._run, crop(image, region['box']), REGION_CONFIGS[region['kind']],
+                                  deadline, best['config_ms'])
+            for region in regions
+        ]
+        results = []
+        for region, future in zip(regions, futures):
+            try:
+                _, data = future.result()
+            except DeadlineExceeded:
+                best['timed_out'] = True
+                continue
+            except Exception as e:
+                best['configs_tried'] += 1
+                if deadline is not None and deadline.expired():
+                    best['timed_out'] = True
+                print(f"  Región {region['box']}: Error - {str(e)}")
+                continue
+            best['configs_tried'] += 1
+            results.append((region, data))
+
+        best['layout'] = {
+            'regions': len(regions),
+            'lines': sum(1 for region in regions if region['kind'] == 'line'),
+            'blocks': sum(1 for region in regions if region['kind'] == 'block'),
+            'pixel_ratio': round(region_pixels / page_pixels, 3),
+        }
+        if not results:
+            return
+
+        data = merge_region_data(results)
+        text = text_from_data(data)
+        with SCORING_SECONDS.time():
+            score, _ = score_ocr_result(text, data)
+        best.update({'text': text, 'data': data, 'config': 'regions', 'score': score})
+
+    def _search_targeted(self, image, configs, best, tried, deadline=None):
+        """
+        Una pasada de página completa con la configuración que más suele ganar
+        y re-OCR solo de los valores de los campos clave que faltan o tienen
+        poca confianza (ver targeted.py)
+        """
+        first = self.stats.order(configs)[0]
+        print(f"🔍 OCR dirigido: pasada rápida con {first}")
+        self._evaluate(image, [first], best, tried, deadline)
+        best['targeted'] = {'retried': [], 'improved': [], 'crops': 0}
+        if best['data'] is None or best['timed_out']:
+            return
+
+        invoice_data = extract_invoice_data(best['text'])
+        anchors = [anchor for anchor in find_anchors(best['data']) if needs_retry(anchor, invoice_data)]
+        if not anchors:
+            print("  ⚡ Campos clave leídos con confianza: sin re-OCR")
+            return
+
+        # Todos los recortes y configuraciones a la vez en el pool
+        jobs = []
+        for anchor in anchors:
+            box = value_box(best['data'], anchor, image.shape)
+            piece = crop(image, box)
+            for config in FIELD_ANCHORS[anchor['field']]['configs']:
+                jobs.append((anchor, box, config, self._executor.submit(
+                    self._run, piece, config, deadline, best['config_ms'])))
+        best['targeted']['crops'] = len(jobs)
+
+        readings = {}
+        for anchor, box, config, future in jobs:
+            try:
+                _, data = future.result()
+            except DeadlineExceeded:
+                best['timed_out'] = True
+                continue
+            except Exception as e:
+                if deadline is not None and deadline.expired():
+                    best['timed_out'] = True
+                print(f"  Campo {anchor['field']} ({config}): Error - {str(e)}")
+                continue
+            readings.setdefault(anchor['anchor'], (anchor, box, []))[2].append((config, data))
+
+        # De la última etiqueta a la primera para no mover los índices pendientes
+        data = best['data']
+        for anchor_index in sorted(readings, reverse=True):
+            anchor, box, results = readings[anchor_index]
+            best['targeted']['retried'].append(anchor['field'])
+            reading = best_reading(results)
+            if reading is None or reading[2] <= anchor['value_conf']:
+                continue
+            config, reading_data, conf = reading
+            print(f"  🎯 {anchor['field']}: confianza {anchor['value_conf']:.0f} -> {conf:.0f} ({config})")
+            data = patch_value(data, anchor, reading_data, box)
+            best['targeted']['improved'].append(anchor['field'])
+
+        if best['targeted']['improved']:
+            text = text_from_data(data)
+            with SCORING_SECONDS.time():
+                score, _ = score_ocr_result(text, data)
+            best.update({'text': text, 'data': data, 'score': score})
+
+    def search(self, image, configs=OCR_CONFIGS, mode=None, deadline=None, text_height=None):
+        """
+        Busca la mejor configuración de OCR para la imagen
+
+        - exhaustive: prueba todas las configuraciones a la vez
+        - adaptive: prueba primero las que más suelen ganar y se detiene en
+          cuanto el score supera el umbral o deja de mejorar
+        - regions: una sola pasada por región de texto (ver layout.py);
+          `text_height` es la altura de carácter estimada, si se conoce
+        - targeted: una pasada rápida y re-OCR solo de los campos clave
+          dudosos (ver targeted.py)
+
+        Con `deadline` las configuraciones que no terminan a tiempo se cortan
+        y se devuelve la mejor encontrada hasta entonces con timed_out=True
+        """
+        mode = mode or self.search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {mode}")
+
+        best = {
+            'text': '',
+            'data': None,
+            'config': configs[0],
+            'score': 0,
+            'configs_tried': 0,
+            'search_mode': mode,
+            'timed_out': False,
+            'config_ms': {},
+        }
+        tried = []
+
+        if mode == 'regions':
+            self._search_regions(image, best, deadline, text_height)
+        elif mode == 'targeted':
+            self._search_targeted(image, configs, best, tried, deadline)
+        elif mode == 'exhaustive':
+            print(f"🔍 Probando {len(configs)} configuraciones OPTIMIZADAS de OCR ({self.max_workers} workers)...")
+            with self._share(image) as source:
+                self._evaluate(source, list(configs), best, tried, deadline)
+        else:
+            ordered = self.stats.order(configs)
+            print(f"🔍 Búsqueda adaptativa entre {len(configs)} configuraciones (umbral={self.score_threshold})...")
+            stalled = 0
+            with self._share(image) as source:
+                for start in range(0, len(ordered), self.adaptive_batch):
+                    improved = self._evaluate(source, ordered[start:start + self.adaptive_batch], best, tried, deadline)
+                    if best['timed_out']:
+                        break
+                    if best['score'] >= self.score_threshold:
+                        print(f"  ⚡ Umbral alcanzado tras {best['configs_tried']} configuraciones")
+                        break
+                    stalled = 0 if improved else stalled + 1
+                    if stalled >= self.patience:
+                        print(f"  ⚡ Sin mejora tras {best['configs_tried']} configuraciones")
+                        break
+
+        if best['timed_out']:
+            print(f"  ⏱️  Tiempo agotado tras {best['configs_tried']} configuraciones")
+
+        # Alimentar el historial que ordena la búsqueda adaptativa
+        # (una búsqueda cortada no dice nada de las configuraciones que faltaron)
+        if best['data'] is not None and not best['timed_out'] and mode in ('exhaustive', 'adaptive'):
+            self.stats.record(tried, best['config'])
+
+        return best
+
+    def warmup(self, image, configs=OCR_CONFIGS):
+        """
+        Ejecuta las configuraciones una vez para cargar los modelos de
+        Tesseract en los workers (no cuenta en el historial de victorias)
+        """
+        best = {'text': '', 'data': None, 'config': configs[0], 'score': 0, 'configs_tried': 0,
+                'timed_out': False, 'config_ms': {}}
+        with self._share(image) as source:
+            self._evaluate(source, list(configs), best, [])
+        return best
+
+    def sweep(self, image, configs=OCR_CONFIGS):
+        """Prueba todas las configuraciones en paralelo y devuelve la mejor"""
+        return self.search(image, configs, mode='exhaustive')
+
+    def shutdown(self):
+        """Libera los workers del pool y guarda el historial pendiente"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.stats.flush()
@@ -0,0 +1,110 @@
+"""
+Almacén de resultados de OCR para poder re-extraer sin repetir el OCR
+
+Por cada factura procesada se guarda el texto de Tesseract, las palabras de
+image_to_data (en columnas, comprimidas con zlib), la configuración ganadora
+y la versión del pipeline. Al cambiar los patrones de extraction.py basta con
+pasar los textos guardados por el extractor (ver reextract.py).
+"""
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from cache import sqlite_connection
+
+
+def pack_words(data):
+    """Comprime el diccionario de image_to_data (ya está en columnas)"""
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack_words(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class OCRStore:
+    """Tabla sqlite con el OCR de cada factura y sus últimos campos extraídos"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with sqlite_connection(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS ocr_results ('
+                'image_hash TEXT NOT NULL, pipeline_version TEXT NOT NULL, '
+                'filename TEXT, ocr_config TEXT, ocr_score REAL, '
+                'text TEXT NOT NULL, words BLOB, created REAL NOT NULL, '
+                'invoice_data TEXT, extracted REAL, '
+                'PRIMARY KEY (image_hash, pipeline_version))'
+            )
+
+    def save(self, image_hash, pipeline_version, text, data, ocr_config=None,
+             ocr_score=None, invoice_data=None, filename=None):
+        """Guarda (o reemplaza) el OCR de una imagen para una versión del pipeline"""
+        now = time.time()
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO ocr_results (image_hash, pipeline_version, filename, '
+                'ocr_config, ocr_score, text, words, created, invoice_data, extracted) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (image_hash, pipeline_version, filename, ocr_config, ocr_score, text,
+                 pack_words(data) if data is not None else None, now,
+                 json.dumps(invoice_data) if invoice_data is not None else None,
+                 now if invoice_data is not None else None)
+            )
+
+    def get(self, image_hash, pipeline_version):
+        """Fila guardada como diccionario (con las palabras descomprimidas) o None"""
+        with sqlite_connection(self.path) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                'SELECT * FROM ocr_results WHERE image_hash = ? AND pipeline_version = ?',
+                (image_hash, pipeline_version)
+            ).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        if result['words'] is not None:
+            result['words'] = unpack_words(result['words'])
+        if result['invoice_data'] is not None:
+            result['invoice_data'] = json.loads(result['invoice_data'])
+        return result
+
+    def iter_texts(self, pipeline_version=None, batch_size=1000):
+        """
+        Recorre (rowid, texto) en orden sin cargar toda la tabla
+        Cada lote usa su propia consulta, así se puede escribir mientras tanto
+        """
+        last = 0
+        while True:
+            query = 'SELECT rowid, text FROM ocr_results WHERE rowid > ?'
+            args = [last]
+            if pipeline_version is not None:
+                query += ' AND pipeline_version = ?'
+                args.append(pipeline_version)
+            query += ' ORDER BY rowid LIMIT ?'
+            args.append(batch_size)
+
+            with sqlite_connection(self.path) as conn:
+                rows = conn.execute(query, args).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def update_extractions(self, rows):
+        """Escribe los campos re-extraídos: `rows` es una lista de (rowid, invoice_data)"""
+        now = time.time()
+        with sqlite_connection(self.path) as conn:
+            conn.executemany(
+                'UPDATE ocr_results SET invoice_data = ?, extracted = ? WHERE rowid = ?',
+                [(json.dumps(invoice_data), now, rowid) for rowid, invoice_data in rows]
+            )
+
+    def stats(self):
+        with sqlite_connection(self.path) as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM ocr_results').fetchone()[0]
+        return {'entries': entries, 'path': self.path}
@@ -0,0 +1,102 @@
+"""
+Lectura de facturas en PDF
+
+Las páginas se recorren de una en una para que un extracto de 100 páginas no
+ocupe más memoria que las pocas que se están procesando a la vez:
+- si la página tiene capa de texto (PDF generado digitalmente) se usa ese
+  texto directamente y no hace falta OCR
+- si no (PDF escaneado) se rasteriza a los DPI pedidos como imagen en gris
+  (uint8, un canal)
+
+Usa pypdfium2 (opcional). pdfium no es seguro entre hilos (ni siquiera con
+documentos distintos), así que todas sus llamadas pasan por un lock global;
+el OCR de las páginas ya rasterizadas sí puede repartirse entre workers.
+"""
+import threading
+
+import numpy as np
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+PDF_MAGIC = b'%PDF-'
+
+# Serializa todas las llamadas a pdfium del proceso
+_pdfium_lock = threading.Lock()
+
+
+class PDFError(Exception):
+    """El PDF no se puede leer (no válido, cifrado o sin soporte instalado)"""
+
+
+def is_pdf(data):
+    """Los PDF empiezan por '%PDF-' (se permite algo de basura delante)"""
+    return PDF_MAGIC in data[:1024]
+
+
+def open_pdf(data):
+    if pdfium is None:
+        raise PDFError('Soporte de PDF no disponible: instalar pypdfium2')
+    try:
+        return pdfium.PdfDocument(data)
+    except pdfium.PdfiumError as e:
+        raise PDFError(f'No se pudo leer el PDF: {e}')
+
+
+def page_text(page):
+    """Texto de la capa de texto de la página ('' si es escaneada)"""
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range().replace('\r\n', '\n').replace('\r', '\n')
+    finally:
+        textpage.close()
+
+
+def render_page(page, dpi=300):
+    """Rasteriza la página en gris (uint8): el preprocesamiento no usa el color"""
+    bitmap = page.render(scale=dpi / 72, grayscale=True)
+    try:
+        image = bitmap.to_numpy()
+        if image.ndim == 3:
+            # Versiones que devuelven el gris replicado en varios canales
+            image = image[:, :, 0]
+        # Copiar: el array apunta al buffer del bitmap que se libera ahora
+        return np.ascontiguousarray(image)
+    finally:
+        bitmap.close()
+
+
+def iter_pages(data, dpi=300, min_text_chars=20, max_pages=None):
+    """
+    Recorre las páginas del PDF devolviendo diccionarios con:
+    - page: número de página (desde 1)
+    - text: texto de la capa de texto, o None si hay que hacer OCR
+    - image: imagen en gris (uint8, un canal) rasterizada, o None si se usó la capa de texto
+    """
+    with _pdfium_lock:
+        pdf = open_pdf(data)
+        n_pages = len(pdf)
+    try:
+        if max_pages is not None and n_pages > max_pages:
+            raise PDFError(f'El PDF tiene {n_pages} páginas (máximo {max_pages})')
+
+        for index in range(n_pages):
+            # El lock solo se mantiene mientras se lee la página, no mientras
+            # el consumidor la procesa
+            with _pdfium_lock:
+                page = pdf[index]
+                try:
+                    text = page_text(page)
+                    if len(text.strip()) >= min_text_chars:
+                        item = {'page': index + 1, 'text': text, 'image': None}
+                    else:
+                        item = {'page': index + 1, 'text': None, 'image': render_page(page, dpi)}
+                finally:
+                    page.close()
+            yield item
+            del item
+    finally:
+        with _pdfium_lock:
+            pdf.close()
@@ -0,0 +1,897 @@
+"""
+Pipeline de preprocesamiento de imágenes para OCR
+
+Cada perfil declara sus etapas (nombre, función, entradas y parámetros) y la
+etapa de salida. Solo se calculan las etapas de las que depende la salida,
+y se mide el tiempo de cada una.
+
+Antes de los perfiles, si se pide, se busca el contorno del papel en una
+copia reducida y se endereza solo esa zona (fotos de móvil con la factura
+sobre una mesa), de modo que el fondo no se reescala ni se filtra.
+
+También se puede detectar si la página está de lado o boca abajo (líneas de
+texto verticales, caracteres apoyados arriba) y girarla antes de nada.
+
+Con el perfil 'auto' un triaje rápido sobre una copia reducida (nitidez,
+contraste, ruido y tamaño del texto) elige entre 'light', 'medium' y
+'heavy', de modo que los escaneos limpios no pasan por las etapas caras.
+"""
+import io
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+DEFAULT_PROFILE = 'heavy'
+
+# Perfil que decide con el triaje cuál de los otros usar
+AUTO_PROFILE = 'auto'
+
+# Altura de carácter (px) con la que mejor lee Tesseract
+TARGET_TEXT_HEIGHT = 32
+
+# Límite de píxeles tras el reescalado (las etapas siguientes escalan con él)
+MAX_PIXELS = 24_000_000
+
+
+class Stage:
+    """Etapa del pipeline: aplica `func` a las salidas de sus etapas de entrada"""
+
+    def __init__(self, name, func, inputs, **params):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params
+
+
+class Profile:
+    """Conjunto de etapas declaradas y la etapa cuyo resultado se entrega al OCR"""
+
+    def __init__(self, name, output, stages):
+        self.name = name
+        self.output = output
+        self.stages = {stage.name: stage for stage in stages}
+
+
+# ---------------------------------------------------------------------------
+# Funciones de las etapas
+# Todas reciben `info` (metadatos de la ejecución) seguido de sus entradas
+# ---------------------------------------------------------------------------
+
+def estimate_text_height(image, max_side=1600):
+    """
+    Estima la altura típica de los caracteres (en píxeles de la imagen original)
+    Usa componentes conexas sobre una copia reducida; devuelve None si no
+    encuentra suficientes candidatos a carácter
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    ratio = min(1.0, max_side / max(h, w))
+    if ratio < 1.0:
+        gray = cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    stats = stats[1:]  # Sin el fondo
+
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    fill = stats[:, cv2.CC_STAT_AREA] / np.maximum(heights * widths, 1)
+
+    # Candidatos a carácter: ni ruido, ni líneas, ni bloques rellenos
+    is_char = (
+        (heights >= 3) & (heights <= gray.shape[0] * 0.1) &
+        (widths <= heights * 3) & (fill > 0.1) & (fill < 0.95)
+    )
+    if np.count_nonzero(is_char) < 10:
+        return None
+    return float(np.median(heights[is_char])) / ratio
+
+
+def upscale(info, image, factor=4, target_text_height=None, max_pixels=None):
+    """
+    Reescalado según la resolución de la imagen
+
+    Con `target_text_height` el factor se elige para que los caracteres
+    queden a esa altura (la que mejor lee Tesseract), estimada con
+    componentes conexas o, en su defecto, con los DPI de la imagen. Si no
+    hay estimación se usa `factor`. `max_pixels` limita el tamaño final, de
+    modo que los escaneos grandes se reducen en lugar de ampliarse.
+    """
+    h, w = image.shape[:2]
+    source = 'fixed'
+
+    if target_text_height:
+        # El triaje ya la estimó sobre la misma imagen
+        text_height = info['triage']['text_height_px'] if 'triage' in info else estimate_text_height(image)
+        if text_height:
+            source = 'components'
+        elif info.get('source_dpi'):
+            # Texto de 10 pt: ~0.097 pulgadas de altura de mayúscula
+            text_height = 0.097 * info['source_dpi']
+            source = 'dpi'
+
+        if text_height:
+            info['text_height_px'] = round(text_height, 1)
+            factor = min(target_text_height / text_height, factor)
+        else:
+            source = 'default'
+
+    if max_pixels and w * h * factor * factor > max_pixels:
+        factor = (max_pixels / (w * h)) ** 0.5
+        source += '+capped'
+
+    info['scale'] = round(factor, 3)
+    info['scale_source'] = source
+
+    if abs(factor - 1.0) < 0.05:
+        return image
+    new_size = (max(1, round(w * factor)), max(1, round(h * factor)))
+    interpolation = cv2.INTER_CUBIC if factor > 1 else cv2.INTER_AREA
+    return cv2.resize(image, new_size, interpolation=interpolation)
+
+
+def to_gray(info, image):
+    """Convertir a escala de grises"""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def estimate_skew(info, image, max_side=1000, max_angle=15, max_lines=50):
+    """
+    Estima la inclinación del texto (grados) sobre una copia reducida
+
+    Busca con Hough solo líneas casi horizontales (±max_angle) y toma la
+    mediana de las más votadas, todo vectorizado con NumPy. Positivo
+    significa que el texto baja hacia la derecha.
+
+    El umbral de votos es bajo (1/20 del ancho): una línea de texto
+    inclinada reparte sus bordes entre varias rectas y con un umbral alto
+    Hough no devuelve ninguna. El ruido se descarta al quedarse solo con las
+    `max_lines` más votadas.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    ratio = min(1.0, max_side / max(h, w))
+    if ratio < 1.0:
+        gray = cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+
+    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    lines = cv2.HoughLines(
+        edges, 1, np.pi / 720, threshold=max(30, gray.shape[1] // 20),
+        min_theta=np.deg2rad(90 - max_angle), max_theta=np.deg2rad(90 + max_angle)
+    )
+
+    angle = 0.0
+    if lines is not None:
+        # Las líneas vienen ordenadas por votos: quedarse con las más fuertes
+        skews = np.rad2deg(lines[:max_lines, 0, 1]) - 90
+        skews = skews[np.abs(skews) <= max_angle]
+        if skews.size:
+            angle = float(np.median(skews))
+
+    info['skew_angle'] = round(angle, 2) + 0.0  # Evitar -0.0 en la respuesta
+    return angle
+
+
+def rotate(info, image, angle, min_angle=0.1):
+    """
+    Endereza la imagen (una sola rotación, sobre la imagen final)
+    Rellena con blanco y sin interpolar para no ensuciar la binarización
+    """
+    if abs(angle) <= min_angle:
+        return image
+    h, w = image.shape[:2]
+    rotation_matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(image, rotation_matrix, (w, h), flags=cv2.INTER_NEAREST,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+
+def clahe(info, gray, clip_limit, tile_grid_size):
+    """Mejora de contraste local (CLAHE)"""
+    return cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size).apply(gray)
+
+
+def equalize(info, gray):
+    """Normalización de histograma"""
+    return cv2.equalizeHist(gray)
+
+
+def blend_contrast(info, enhanced1, enhanced2, enhanced3, enhanced4):
+    """Combinar TODAS las estrategias de contraste"""
+    temp = cv2.addWeighted(enhanced1, 0.4, enhanced2, 0.3, 0)
+    temp = cv2.addWeighted(temp, 0.7, enhanced3, 0.2, 0)
+    return cv2.addWeighted(temp, 0.8, enhanced4, 0.1, 0)
+
+
+def bilateral(info, image, d, sigma_color, sigma_space):
+    """Filtro bilateral (reduce ruido conservando bordes)"""
+    return cv2.bilateralFilter(image, d, sigma_color, sigma_space)
+
+
+def median(info, image, ksize):
+    """Filtro de mediana"""
+    return cv2.medianBlur(image, ksize)
+
+
+# Kernel de sharpening EXTREMO
+KERNEL_SHARPEN = np.array([[-1,-1,-1,-1,-1,-1,-1],
+                           [-1, 1, 1, 1, 1, 1,-1],
+                           [-1, 1, 2, 2, 2, 1,-1],
+                           [-1, 1, 2, 8, 2, 1,-1],
+                           [-1, 1, 2, 2, 2, 1,-1],
+                           [-1, 1, 1, 1, 1, 1,-1],
+                           [-1,-1,-1,-1,-1,-1,-1]]) / 8.0
+
+
+def sharpen(info, image):
+    """Sharpening EXTREMO"""
+    return cv2.filter2D(image, -1, KERNEL_SHARPEN)
+
+
+def threshold_otsu(info, image):
+    """Binarización de Otsu"""
+    _, thresh = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+def threshold_adaptive(info, image, method, block_size, c):
+    """Binarización adaptativa"""
+    return cv2.adaptiveThreshold(image, 255, method, cv2.THRESH_BINARY, block_size, c)
+
+
+def threshold_percentile(info, image, low=10, high=90):
+    """Threshold manual en el punto medio entre dos percentiles"""
+    threshold_val = (np.percentile(image, low) + np.percentile(image, high)) / 2
+    _, thresh = cv2.threshold(image, threshold_val, 255, cv2.THRESH_BINARY)
+    return thresh
+
+
+def threshold_fixed(info, image, value):
+    """Threshold con valor fijo"""
+    _, thresh = cv2.threshold(image, value, 255, cv2.THRESH_BINARY)
+    return thresh
+
+
+def combine_and(info, *images):
+    """Intersección de varias binarizaciones"""
+    final = images[0].copy()
+    for image in images[1:]:
+        final = cv2.bitwise_and(final, image)
+    return final
+
+
+def morphology(info, image, op, shape, ksize):
+    """Operación morfológica (cerrar, abrir)"""
+    kernel = cv2.getStructuringElement(shape, ksize)
+    return cv2.morphologyEx(image, op, kernel)
+
+
+def dilate(info, image, shape, ksize, iterations=1):
+    """Dilatación"""
+    kernel = cv2.getStructuringElement(shape, ksize)
+    return cv2.dilate(image, kernel, iterations=iterations)
+
+
+def erode(info, image, shape, ksize, iterations=1):
+    """Erosión"""
+    kernel = cv2.getStructuringElement(shape, ksize)
+    return cv2.erode(image, kernel, iterations=iterations)
+
+
+# ---------------------------------------------------------------------------
+# Perfiles
+# ---------------------------------------------------------------------------
+
+PROFILES = {
+    # Escaneos nítidos y con buen contraste: Tesseract binariza bien por sí mismo
+    'light': Profile('light', output='deskew', stages=[
+        Stage('upscale', upscale, ['image'], factor=2,
+              target_text_height=TARGET_TEXT_HEIGHT, max_pixels=MAX_PIXELS),
+        Stage('gray', to_gray, ['upscale']),
+        Stage('skew', estimate_skew, ['image']),
+        Stage('deskew', rotate, ['gray', 'skew']),
+    ]),
+
+    # Fotos aceptables: contraste local, algo de limpieza y binarización adaptativa
+    'medium': Profile('medium', output='deskew', stages=[
+        Stage('upscale', upscale, ['image'], factor=3,
+              target_text_height=TARGET_TEXT_HEIGHT, max_pixels=MAX_PIXELS),
+        Stage('gray', to_gray, ['upscale']),
+        Stage('skew', estimate_skew, ['image']),
+        Stage('clahe', clahe, ['gray'], clip_limit=2.0, tile_grid_size=(8, 8)),
+        Stage('median', median, ['clahe'], ksize=3),
+        Stage('binary', threshold_adaptive, ['median'],
+              method=cv2.ADAPTIVE_THRESH_GAUSSIAN_C, block_size=31, c=15),
+        Stage('deskew', rotate, ['binary', 'skew']),
+    ]),
+
+    # ENFOQUE RADICAL para facturas extremadamente problemáticas
+    'heavy': Profile('heavy', output='deskew', stages=[
+        # Factor máximo 4x; se ajusta a la altura del texto y al límite de píxeles
+        Stage('upscale', upscale, ['image'], factor=4,
+              target_text_height=TARGET_TEXT_HEIGHT, max_pixels=MAX_PIXELS),
+        Stage('gray', to_gray, ['upscale']),
+
+        # Inclinación estimada sobre la imagen original reducida
+        Stage('skew', estimate_skew, ['image']),
+
+        # Aplicar CLAHE múltiples veces con diferentes parámetros
+        Stage('clahe_strong', clahe, ['gray'], clip_limit=6.0, tile_grid_size=(4, 4)),
+        Stage('clahe_soft', clahe, ['gray'], clip_limit=2.0, tile_grid_size=(12, 12)),
+        Stage('clahe_extreme', clahe, ['gray'], clip_limit=8.0, tile_grid_size=(6, 6)),
+        Stage('equalize', equalize, ['gray']),
+        Stage('contrast', blend_contrast, ['clahe_strong', 'clahe_soft', 'clahe_extreme', 'equalize']),
+
+        # Filtros de ruido ULTRA-AGRESIVOS
+        Stage('bilateral_strong', bilateral, ['contrast'], d=15, sigma_color=80, sigma_space=80),
+        Stage('median', median, ['bilateral_strong'], ksize=5),
+        Stage('bilateral_soft', bilateral, ['median'], d=9, sigma_color=60, sigma_space=60),
+        Stage('sharpen', sharpen, ['bilateral_soft']),
+
+        # Métodos de thresholding (solo se calculan los que llegan a la salida)
+        Stage('otsu', threshold_otsu, ['sharpen']),
+        Stage('adaptive_gaussian', threshold_adaptive, ['sharpen'],
+              method=cv2.ADAPTIVE_THRESH_GAUSSIAN_C, block_size=7, c=1),
+        Stage('adaptive_mean', threshold_adaptive, ['sharpen'],
+              method=cv2.ADAPTIVE_THRESH_MEAN_C, block_size=11, c=2),
+        Stage('percentile', threshold_percentile, ['sharpen'], low=10, high=90),
+        Stage('fixed_low', threshold_fixed, ['sharpen'], value=100),
+        Stage('fixed_high', threshold_fixed, ['sharpen'], value=200),
+
+        # Usar Otsu como base y combinar con threshold adaptativo
+        Stage('binary', combine_and, ['otsu', 'adaptive_gaussian']),
+
+        # Operaciones morfológicas ULTRA-AGRESIVAS
+        Stage('close', morphology, ['binary'], op=cv2.MORPH_CLOSE, shape=cv2.MORPH_ELLIPSE, ksize=(4, 4)),
+        Stage('open', morphology, ['close'], op=cv2.MORPH_OPEN, shape=cv2.MORPH_ELLIPSE, ksize=(3, 3)),
+        Stage('dilate', dilate, ['open'], shape=cv2.MORPH_RECT, ksize=(3, 3), iterations=2),
+        Stage('erode', erode, ['dilate'], shape=cv2.MORPH_ELLIPSE, ksize=(2, 2), iterations=1),
+
+        # Corrección de rotación aplicada una sola vez al resultado
+        Stage('deskew', rotate, ['erode', 'skew']),
+    ]),
+}
+
+
+# ---------------------------------------------------------------------------
+# Recorte del documento
+# ---------------------------------------------------------------------------
+
+# Lado máximo de la copia reducida sobre la que se busca el papel
+DOCUMENT_MAX_SIDE = 500
+
+# El papel debe ocupar al menos esto del encuadre; por encima de
+# DOCUMENT_MAX_AREA ya llena la imagen (escaneos) y no compensa recortar
+DOCUMENT_MIN_AREA = 0.15
+DOCUMENT_MAX_AREA = 0.9
+
+# El papel debe ser más claro que lo que lo rodea (niveles de gris); evita
+# confundirlo con el recuadro de una tabla dentro de la propia factura
+DOCUMENT_MIN_BRIGHTNESS_GAP = 25
+
+
+def _order_corners(points):
+    """Esquinas en orden: superior izquierda, superior derecha, inferior derecha, inferior izquierda"""
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)], points[np.argmin(diffs)],
+        points[np.argmax(sums)], points[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+def _quad_candidates(gray):
+    """Cuadriláteros candidatos: contornos de bordes y, si no, la mayor zona clara"""
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    center = float(np.median(blurred))
+    edges = cv2.Canny(blurred, int(max(0, 0.66 * center)), int(min(255, 1.33 * center)))
+    edges = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+
+    _, bright = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    bright = cv2.morphologyEx(bright, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9)))
+
+    for mask in (edges, bright):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+            hull = cv2.convexHull(contour)
+            quad = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+            if len(quad) != 4:
+                # Esquinas redondeadas o tapadas: el rectángulo mínimo que lo contiene
+                quad = cv2.boxPoints(cv2.minAreaRect(hull))
+            yield _order_corners(quad)
+
+
+def find_document(image, max_side=DOCUMENT_MAX_SIDE):
+    """
+    Contorno del papel en la imagen (4 esquinas en píxeles de `image`)
+
+    Se busca sobre una copia reducida en gris: primero los contornos de los
+    bordes y, si no, la mayor zona clara. Se acepta el mayor cuadrilátero
+    convexo que ocupe entre DOCUMENT_MIN_AREA y DOCUMENT_MAX_AREA del
+    encuadre y sea más claro que su entorno. Devuelve (esquinas, fracción
+    del área) o None si no hay papel que recortar.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    ratio = min(1.0, max_side / max(h, w))
+    small = cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA) if ratio < 1.0 else gray
+    frame_area = float(small.shape[0] * small.shape[1])
+
+    for quad in _quad_candidates(small):
+        area = cv2.contourArea(quad) / frame_area
+        if not DOCUMENT_MIN_AREA <= area <= DOCUMENT_MAX_AREA:
+            continue
+        if not cv2.isContourConvex(quad.astype(np.int32)):
+            continue
+        inside = np.zeros(small.shape, np.uint8)
+        cv2.fillConvexPoly(inside, quad.astype(np.int32), 255)
+        paper = cv2.mean(small, mask=inside)[0]
+        background = cv2.mean(small, mask=cv2.bitwise_not(inside))[0]
+        if paper - background < DOCUMENT_MIN_BRIGHTNESS_GAP:
+            continue
+        corners = np.clip(quad / ratio, 0, [w - 1, h - 1]).astype(np.float32)
+        return corners, round(area, 3)
+    return None
+
+
+def crop_document(image, max_side=DOCUMENT_MAX_SIDE):
+    """
+    Recorta el papel y corrige la perspectiva (rectángulo plano)
+    Devuelve la imagen (la original si no se encontró papel) y la información
+    del recorte, o None si no se recortó
+    """
+    found = find_document(image, max_side=max_side)
+    if found is None:
+        return image, None
+    corners, area = found
+    tl, tr, br, bl = corners
+    width = int(round(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))))
+    height = int(round(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    warped = cv2.warpPerspective(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                 borderMode=cv2.BORDER_REPLICATE)
+
+    # Las esquinas se encontraron en la copia reducida: recortar el error de
+    # redondeo (un par de píxeles reducidos) para que no quede un filo de fondo
+    margin = int(np.ceil(1.5 * max(image.shape[:2]) / max_side))
+    if width > 4 * margin and height > 4 * margin:
+        warped = warped[margin:height - margin, margin:width - margin]
+        width, height = width - 2 * margin, height - 2 * margin
+    return warped, {
+        'corners': [[int(round(x)), int(round(y))] for x, y in corners],
+        'area_ratio': area,
+        'size': [width, height],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Orientación de la página
+# ---------------------------------------------------------------------------
+
+# Lado máximo de la miniatura sobre la que se decide la orientación y altura
+# mínima del texto en ella (con texto pequeño se usa una copia mayor)
+ORIENTATION_MAX_SIDE = 800
+ORIENTATION_MIN_TEXT_HEIGHT = 16
+
+# Los vecinos en vertical deben dominar por este factor para girar 90°, con
+# un mínimo de caracteres para decidir
+ORIENTATION_MIN_RATIO = 2.0
+ORIENTATION_MIN_CHARS = 20
+
+# Asimetría mínima (-1 a 1) entre caracteres vecinos con la base alineada y
+# con la parte alta alineada para dar la vuelta a la página
+ORIENTATION_MIN_ASYMMETRY = 0.08
+
+# Caracteres (repartidos por la página) cuyo vecino se busca, y bloques de
+# esa búsqueda (limitan el tiempo y la memoria en páginas densas)
+ORIENTATION_MAX_CHARS = 1000
+NEIGHBOR_CHUNK = 256
+
+
+def _char_boxes(ink):
+    """
+    Cajas (x, y, w, h) de los componentes con tamaño de carácter y su
+    tamaño típico (el lado mayor, que no depende de la orientación)
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:, :4].astype(np.float64)
+    sides = stats[:, 2:4].max(axis=1)
+    plausible = (sides >= 3) & (sides <= max(ink.shape) * 0.1)
+    if np.count_nonzero(plausible) < ORIENTATION_MIN_CHARS:
+        return stats[:0], 0.0
+    size = float(np.median(sides[plausible]))
+    # Sin puntos, comas ni líneas o bloques que junten varios caracteres
+    is_char = (sides >= size * 0.4) & (sides <= size * 2) & (stats[:, 2:4].min(axis=1) >= size * 0.15)
+    return stats[is_char], size
+
+
+def _sample(boxes):
+    """Índices de como mucho ORIENTATION_MAX_CHARS cajas repartidas por toda la página"""
+    return np.unique(np.linspace(0, len(boxes) - 1, min(len(boxes), ORIENTATION_MAX_CHARS)).astype(int))
+
+
+def _nearest_neighbors(boxes, queries, vertical=False):
+    """
+    Para cada caja de `queries` (índices), distancia a la caja más cercana
+    en la misma fila (o columna con `vertical`) y el índice de esa caja (-1
+    si no hay ninguna). Dos cajas comparten fila si se solapan en vertical
+    al menos la mitad de la menor; la distancia es la horizontal entre sus
+    centros, que separa bien letras vecinas de líneas vecinas aunque las
+    líneas se toquen
+    """
+    if vertical:
+        boxes = boxes[:, [1, 0, 3, 2]]
+    x, y, w, h = boxes.T
+    centers = x + w / 2
+    distances = np.full(len(queries), np.inf)
+    nearest = np.full(len(queries), -1)
+    for start in range(0, len(queries), NEIGHBOR_CHUNK):
+        rows = slice(start, start + NEIGHBOR_CHUNK)
+        chunk = queries[rows]
+        overlap = np.minimum(y[chunk, None] + h[chunk, None], y + h) - np.maximum(y[chunk, None], y)
+        same_row = overlap >= np.minimum(h[chunk, None], h) * 0.5
+        distance = np.where(same_row, np.abs(centers - centers[chunk, None]), np.inf)
+        index = np.arange(len(chunk))
+        distance[index, chunk] = np.inf
+        nearest[rows] = distance.argmin(axis=1)
+        distances[rows] = distance[index, nearest[rows]]
+    nearest[np.isinf(distances)] = -1
+    return distances, nearest
+
+
+def _neighbor_votes(boxes, size):
+    """
+    Caracteres cuyo vecino más cercano está en su fila y en su columna
+
+    En un texto los caracteres de una misma línea están más juntos que los
+    de líneas vecinas (el espacio entre letras es menor que el interlineado),
+    sea cual sea la separación entre líneas; si la mayoría tiene el vecino
+    más cercano encima o debajo, la página está de lado
+    """
+    queries = _sample(boxes)
+    row_distances, _ = _nearest_neighbors(boxes, queries)
+    column_distances, _ = _nearest_neighbors(boxes, queries, vertical=True)
+    # Un vecino a más de dos caracteres de distancia no es de la misma palabra
+    row_distances[row_distances > size * 2] = np.inf
+    column_distances[column_distances > size * 2] = np.inf
+    in_row = np.count_nonzero(row_distances < column_distances)
+    in_column = np.count_nonzero(column_distances < row_distances)
+    return in_row, in_column
+
+
+def _upright_asymmetry(boxes, size):
+    """
+    Asimetría entre caracteres vecinos de una línea horizontal: en texto
+    latino derecho apoyan en la línea base (bases alineadas) mientras que
+    sus partes altas quedan a varias alturas (minúsculas, mayúsculas y
+    cifras, ascendentes), y hay muchas menos descendentes. Se compara la
+    fracción de parejas con la base alineada con la de parejas con la parte
+    alta alineada: positivo = derecho, negativo = boca abajo
+
+    La inclinación de las líneas se descuenta con la pendiente mediana entre
+    los centros de los vecinos (sin enderezar la imagen: con texto denso la
+    estimación por Hough de una miniatura no es fiable)
+    """
+    queries = _sample(boxes)
+    distances, nearest = _nearest_neighbors(boxes, queries)
+    close = (nearest >= 0) & (distances <= size * 1.5)
+    pairs, others = queries[close], nearest[close]
+    x, y, w, h = boxes.T
+    dx = (x + w / 2)[others] - (x + w / 2)[pairs]
+    pairs, others, dx = pairs[dx != 0], others[dx != 0], dx[dx != 0]
+    if len(pairs) < ORIENTATION_MIN_CHARS:
+        return 0.0
+    slope = np.median(((y + h / 2)[others] - (y + h / 2)[pairs]) / dx)
+    expected = slope * dx
+
+    tolerance = max(1.0, size * 0.08)
+    aligned_tops = np.abs(y[others] - y[pairs] - expected) <= tolerance
+    aligned_bottoms = np.abs((y + h)[others] - (y + h)[pairs] - expected) <= tolerance
+    return float(np.count_nonzero(aligned_bottoms) - np.count_nonzero(aligned_tops)) / len(pairs)
+
+
+def detect_orientation(image, max_side=ORIENTATION_MAX_SIDE):
+    """
+    Giro (0, 90, 180 o 270 grados en sentido horario) que pone la página derecha
+
+    Sobre una copia reducida binarizada se buscan los componentes con tamaño
+    de carácter y, para cada uno, su vecino más cercano: en la misma fila
+    (página derecha o boca abajo) o en la misma columna (página de lado).
+    Con las líneas ya en horizontal se compara la alineación de las bases y
+    de las partes altas de caracteres vecinos (página boca abajo). Sin
+    indicios claros se deja como está. Devuelve el giro y las medidas.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    ratio = min(1.0, max_side / max(h, w))
+    # Con texto pequeño la miniatura no separa los caracteres: reducir menos
+    text_height = estimate_text_height(gray)
+    if text_height:
+        ratio = min(1.0, max(ratio, ORIENTATION_MIN_TEXT_HEIGHT / text_height))
+    small = cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA) if ratio < 1.0 else gray
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    info = {'rotation': 0, 'chars': 0, 'row_neighbors': 0, 'column_neighbors': 0, 'asymmetry': 0.0}
+    boxes, size = _char_boxes(ink)
+    info['chars'] = int(len(boxes))
+    if len(boxes) < ORIENTATION_MIN_CHARS:
+        return 0, info
+
+    in_row, in_column = _neighbor_votes(boxes, size)
+    info['row_neighbors'], info['column_neighbors'] = int(in_row), int(in_column)
+    rotation = 0
+    if in_column > in_row * ORIENTATION_MIN_RATIO and in_column >= ORIENTATION_MIN_CHARS:
+        # De lado: girar 90° en sentido horario y decidir después si está boca abajo
+        rotation = 90
+        boxes, size = _char_boxes(cv2.rotate(ink, cv2.ROTATE_90_CLOCKWISE))
+
+    asymmetry = _upright_asymmetry(boxes, size) if size else 0.0
+    if asymmetry < -ORIENTATION_MIN_ASYMMETRY:
+        rotation = (rotation + 180) % 360
+
+    info['rotation'] = rotation
+    info['asymmetry'] = round(float(asymmetry), 3)
+    return rotation, info
+
+
+ROTATIONS = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+
+def orient(image, max_side=ORIENTATION_MAX_SIDE):
+    """Pone la página derecha; devuelve la imagen (girada o no) y la información"""
+    rotation, info = detect_orientation(image, max_side=max_side)
+    if rotation:
+        image = cv2.rotate(image, ROTATIONS[rotation])
+    return image, info
+
+
+# ---------------------------------------------------------------------------
+# Triaje
+# ---------------------------------------------------------------------------
+
+# Umbrales del triaje (la altura del texto, en píxeles de la imagen original)
+TRIAGE_MAX_SIDE = 1000
+TRIAGE_THRESHOLDS = {
+    # light: todo bien
+    'light': {'min_sharpness': 150, 'min_contrast': 120, 'max_noise': 4.0, 'min_text_height': 12},
+    # medium: nada grave; si no, heavy
+    'medium': {'min_sharpness': 40, 'min_contrast': 60, 'max_noise': 10.0, 'min_text_height': 6},
+}
+
+
+def estimate_noise(gray):
+    """
+    Desviación típica del ruido (método de Immerkær): convolución con un
+    laplaciano que anula bordes y zonas lisas y deja sobre todo el ruido
+    """
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    h, w = gray.shape[:2]
+    if h < 3 or w < 3:
+        return 0.0
+    response = cv2.filter2D(gray.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    return float(np.sqrt(np.pi / 2) * np.abs(response).sum() / (6 * (w - 2) * (h - 2)))
+
+
+def triage(image):
+    """
+    Mide la calidad de la imagen sobre una copia reducida y elige perfil
+
+    - sharpness: varianza del laplaciano (desenfoque si es baja)
+    - contrast: diferencia de gris entre papel y tinta (separados con Otsu)
+    - noise: desviación típica estimada del ruido, sobre un recorte central a
+      resolución completa (al reducir la imagen el ruido se promedia)
+    - text_height_px: altura de carácter en la imagen original
+    Devuelve el nombre del perfil y las medidas.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    ratio = min(1.0, TRIAGE_MAX_SIDE / max(h, w))
+    small = cv2.resize(gray, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA) if ratio < 1.0 else gray
+
+    threshold, _ = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    ink = small[small <= threshold]
+    paper = small[small > threshold]
+    contrast = float(paper.mean() - ink.mean()) if ink.size and paper.size else 0.0
+
+    y0, x0 = max(0, h // 2 - 512), max(0, w // 2 - 512)
+    center = gray[y0:y0 + 1024, x0:x0 + 1024]
+
+    text_height = estimate_text_height(small, max_side=TRIAGE_MAX_SIDE)
+    metrics = {
+        'sharpness': round(float(cv2.Laplacian(small, cv2.CV_64F).var()), 1),
+        'contrast': round(contrast, 1),
+        'noise': round(estimate_noise(center), 2),
+        'text_height_px': round(text_height / ratio, 1) if text_height else None,
+    }
+
+    profile = 'heavy'
+    for name in ('light', 'medium'):
+        limits = TRIAGE_THRESHOLDS[name]
+        if (metrics['sharpness'] >= limits['min_sharpness'] and metrics['contrast'] >= limits['min_contrast']
+                and metrics['noise'] <= limits['max_noise'] and text_height
+                and metrics['text_height_px'] >= limits['min_text_height']):
+            profile = name
+            break
+    metrics['profile'] = profile
+    return profile, metrics
+
+
+# Al decodificar se reduce la imagen (1/2, 1/4, 1/8) mientras conserve al
+# menos estos píxeles: las fotos de 48 MP no se decodifican enteras
+DECODE_MIN_PIXELS = 8_000_000
+
+# Factor de reducción -> modo de lectura de OpenCV (siempre en gris: todos
+# los perfiles trabajan en gris, así no se llega a crear la imagen en color)
+DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def read_header(image_bytes):
+    """
+    Tamaño, DPI y orientación EXIF declarados en la cabecera del archivo
+    (PIL solo lee la cabecera, no decodifica los píxeles)
+    """
+    header = {'size': None, 'dpi': None, 'orientation': 1}
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as pil_image:
+            header['size'] = pil_image.size
+            dpi = pil_image.info.get('dpi')
+            orientation = pil_image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return header
+    if dpi and dpi[0] and dpi[0] >= 50:
+        header['dpi'] = float(dpi[0])
+    if orientation in range(1, 9):
+        header['orientation'] = orientation
+    return header
+
+
+def decode_reduction(width, height, min_pixels=DECODE_MIN_PIXELS):
+    """Mayor factor de reducción (1, 2, 4 u 8) que deja al menos `min_pixels`"""
+    for factor in (8, 4, 2):
+        if width * height / (factor * factor) >= min_pixels:
+            return factor
+    return 1
+
+
+def apply_exif_orientation(image, orientation):
+    """Gira o voltea la imagen según la orientación EXIF (1-8, como ImageOps.exif_transpose)"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode(image_bytes, min_pixels=DECODE_MIN_PIXELS):
+    """
+    Decodifica la imagen subida en gris, reducida si es muy grande y con la
+    orientación EXIF aplicada
+
+    El tamaño se lee de la cabecera para elegir la reducción antes de
+    decodificar (con JPEG la hace el propio decodificador, sin crear la imagen
+    completa). Devuelve la imagen (None si no se pudo decodificar) y la
+    información de la decodificación; los DPI se corrigen por la reducción.
+    """
+    header = read_header(image_bytes)
+    factor = decode_reduction(*header['size'], min_pixels=min_pixels) if header['size'] else 1
+    flags = DECODE_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+
+    info = {
+        'source_size': list(header['size']) if header['size'] else None,
+        'reduction': factor,
+        'exif_orientation': header['orientation'],
+        'dpi': round(header['dpi'] / factor, 1) if header['dpi'] else None,
+    }
+    if image is not None:
+        image = apply_exif_orientation(image, header['orientation'])
+    return image, info
+
+
+def run_pipeline(image, profile=DEFAULT_PROFILE, dpi=None, params=None, deadline=None, document=False,
+                 orientation=False):
+    """
+    Ejecuta el perfil de preprocesamiento sobre la imagen
+    Devuelve la imagen final y la información de la ejecución
+    (perfil usado y tiempo en ms de cada etapa calculada)
+
+    `dpi` son los DPI declarados por el archivo (si los hay) y `params`
+    permite sobreescribir parámetros de etapas: {'upscale': {'max_pixels': ...}}
+    Con `deadline` (deadline.Deadline) se lanza DeadlineExceeded antes de
+    empezar una etapa si ya se agotó el tiempo de la petición
+    Con `document` se recorta antes el papel con su perspectiva
+    (info['document']) y el resto del pipeline solo ve esa zona
+    Con `orientation` se gira la página 90/180/270° si está de lado o boca
+    abajo (info['orientation'], giro en sentido horario)
+    Con el perfil 'auto' el triaje elige el perfil (info['triage'])
+    """
+    source_size = [int(image.shape[1]), int(image.shape[0])]
+    document_info = None
+    if document:
+        start = time.perf_counter()
+        image, document_info = crop_document(image)
+        document_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    orientation_info = None
+    if orientation:
+        start = time.perf_counter()
+        image, orientation_info = orient(image)
+        orientation_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    triage_info = None
+    if profile == AUTO_PROFILE:
+        start = time.perf_counter()
+        profile, triage_info = triage(image)
+        triage_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(f"Perfil de preprocesamiento desconocido: {profile}")
+        profile = PROFILES[profile]
+    params = params or {}
+
+    info = {
+        'profile': profile.name,
+        'source_size': source_size,
+        'source_dpi': dpi,
+        'timings_ms': {},
+    }
+    if document:
+        info['document'] = document_info
+        info['timings_ms']['document'] = document_ms
+    if orientation:
+        info['orientation'] = orientation_info
+        info['timings_ms']['orientation'] = orientation_ms
+    if triage_info is not None:
+        info['triage'] = triage_info
+        info['timings_ms']['triage'] = triage_ms
+    results = {'image': image}
+
+    def compute(name):
+        if name in results:
+            return results[name]
+        stage = profile.stages[name]
+        inputs = [compute(input_name) for input_name in stage.inputs]
+        stage_params = dict(stage.params, **params.get(name, {}))
+        if deadline is not None:
+            deadline.check(f"el preprocesamiento (etapa '{name}')")
+        start = time.perf_counter()
+        results[name] = stage.func(info, *inputs, **stage_params)
+        info['timings_ms'][name] = round((time.perf_counter() - start) * 1000, 2)
+        return results[name]
+
+    final = compute(profile.output)
+    info['output_size'] = [int(final.shape[1]), int(final.shape[0])]
+    info['total_ms'] = round(sum(info['timings_ms'].values()), 2)
+    return final, info
+
+
+def preprocess_image(image, profile=DEFAULT_PROFILE):
+    """
+    Preprocesa la imagen para mejorar el OCR
+    ENFOQUE RADICAL para facturas extremadamente problemáticas
+    """
+    final, _ = run_pipeline(image, profile)
+    return final
@@ -0,0 +1,81 @@
+"""
+Re-extracción de campos sobre el OCR guardado (sin volver a ejecutar Tesseract)
+
+Uso:
+    python reextract.py [--db uploads/ocr_store.sqlite3] [--workers N]
+                        [--pipeline-version V] [--batch-size 1000]
+
+Lee los textos del almacén de OCR por lotes, los pasa por el extractor de
+extraction.py en varios procesos (InvoiceExtractor.extract_many) y guarda los
+nuevos campos en la misma tabla.
+"""
+import argparse
+import os
+import time
+from collections import deque
+
+from config import get_config, upload_path
+from extraction import default_extractor
+from ocr_store import OCRStore
+
+
+def reextract(store, workers=1, pipeline_version=None, batch_size=1000, chunksize=256):
+    """Re-extrae todas las filas del almacén y devuelve un resumen"""
+    rows = store.iter_texts(pipeline_version=pipeline_version, batch_size=batch_size)
+    summary = {'processed': 0, 'errors': 0}
+    pending = []
+
+    # extract_many devuelve los resultados en orden: los rowid esperan en una cola
+    rowids = deque()
+
+    def texts():
+        for rowid, text in rows:
+            rowids.append(rowid)
+            yield text
+
+    def flush():
+        store.update_extractions(pending)
+        summary['processed'] += len(pending)
+        pending.clear()
+
+    results = default_extractor.extract_many(texts(), workers=workers, chunksize=chunksize, return_exceptions=True)
+    for invoice_data in results:
+        rowid = rowids.popleft()
+        if isinstance(invoice_data, Exception):
+            # Los errores no paran el proceso
+            summary['errors'] += 1
+            print(f"⚠️  Fila {rowid}: {invoice_data}")
+            continue
+        pending.append((rowid, invoice_data))
+        if len(pending) >= batch_size:
+            flush()
+            print(f"📄 {summary['processed']} facturas re-extraídas")
+    flush()
+
+    return summary
+
+
+def main():
+    defaults = get_config(os.environ.get('FLASK_ENV', 'default'))
+
+    parser = argparse.ArgumentParser(description='Re-extrae los campos de las facturas a partir del OCR guardado')
+    parser.add_argument('--db', default=upload_path(defaults.UPLOAD_FOLDER, defaults.OCR_STORE_PATH), help='Ruta del almacén de OCR (sqlite)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Procesos de extracción')
+    parser.add_argument('--pipeline-version', default=None, help='Solo filas de esta versión del pipeline')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Filas leídas y escritas por lote')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f'No existe el almacén de OCR: {args.db}')
+
+    store = OCRStore(args.db)
+    start = time.perf_counter()
+    summary = reextract(store, workers=args.workers, pipeline_version=args.pipeline_version,
+                        batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {summary['processed']} facturas re-extraídas en {elapsed:.1f} s "
+          f"({summary['errors']} errores)")
+
+
+if __name__ == '__main__':
+    main()
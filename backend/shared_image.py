@@ -0,0 +1,144 @@
+"""
+Imagen preprocesada compartida con los procesos de tesseract
+
+pytesseract convierte el array a PIL y lo guarda como PNG temporal en cada
+llamada: con el barrido de configuraciones la misma imagen (decenas de MB
+tras el reescalado) se comprime y se escribe una vez por configuración. En
+su lugar la imagen se vuelca una sola vez, sin comprimir (PGM/PPM), en un
+archivo en memoria (/dev/shm) y a cada proceso de tesseract solo se le pasa
+la ruta.
+
+El archivo lleva un contador de referencias: cada configuración en vuelo
+tiene la suya y el archivo se borra cuando termina la última.
+"""
+import os
+import tempfile
+import threading
+import uuid
+
+import cv2
+import numpy as np
+
+# Sistema de archivos en memoria; si no existe (macOS, Windows) el temporal del sistema
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# Si SHARED_DIR se llena (el /dev/shm de Docker es de 64 MB por defecto) se
+# escribe en disco: más lento, pero la petición no falla
+FALLBACK_DIR = tempfile.gettempdir()
+
+PREFIX = 'invoice_ocr_'
+
+
+class SharedImage:
+    """
+    Imagen volcada a un archivo PNM en memoria con contador de referencias
+
+    Se crea con una referencia (la del dueño); acquire() añade una por
+    cada usuario y release() la quita. Como gestor de contexto libera la
+    referencia del dueño al salir.
+    """
+
+    def __init__(self, image, directory=None):
+        self.shape = image.shape
+        self._refs = 1
+        self._lock = threading.Lock()
+
+        directories = [directory or SHARED_DIR]
+        if FALLBACK_DIR not in directories:
+            directories.append(FALLBACK_DIR)
+        name = f'{PREFIX}{os.getpid()}_{uuid.uuid4().hex}.pnm'
+        for i, candidate in enumerate(directories):
+            self.path = os.path.join(candidate, name)
+            try:
+                self._write(image)
+                return
+            except OSError as e:
+                if i == len(directories) - 1:
+                    raise
+                print(f"⚠️  No se pudo escribir la imagen compartida en {candidate} ({e}), se usa {directories[i + 1]}")
+
+    def _write(self, image):
+        # PNM: cabecera de texto y píxeles tal cual (Tesseract lo lee con Leptonica)
+        if image.ndim == 2:
+            magic = 'P5'
+        else:
+            magic = 'P6'
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        header = f'{magic}\n{width} {height}\n255\n'.encode('ascii')
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(memoryview(image).cast('B'))
+        except BaseException:
+            self._remove()
+            raise
+
+    def acquire(self):
+        with self._lock:
+            if self._refs <= 0:
+                raise RuntimeError('La imagen compartida ya se liberó')
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            last = self._refs == 0
+        if last:
+            self._remove()
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def remove_stale(directory=None):
+    """
+    Borra los archivos que dejaron procesos que ya no existen (p. ej. un
+    worker que murió con configuraciones en vuelo); devuelve cuántos borró
+    """
+    if directory is None:
+        return sum(remove_stale(path) for path in {SHARED_DIR, FALLBACK_DIR})
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        if not name.startswith(PREFIX):
+            continue
+        try:
+            pid = int(name[len(PREFIX):].split('_', 1)[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or process_alive(pid):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def process_alive(pid):
+    """True si existe un proceso con ese pid (aunque sea de otro usuario)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
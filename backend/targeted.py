@@ -0,0 +1,171 @@
+"""
+Re-OCR dirigido de los campos clave
+
+El barrido de configuraciones existe sobre todo para que la extracción
+encuentre el total, el IVA, el NIT, la fecha y el número de factura. En el
+modo 'targeted' se hace una sola pasada rápida de la página y, con las cajas
+de las palabras, se localizan las líneas de esas etiquetas ('TOTAL', 'IVA',
+'NIT', 'FACTURA', 'FECHA'). Solo se vuelve a leer el valor de los campos que
+faltan o tienen poca confianza, recortando lo que queda a la derecha de la
+etiqueta y probando configuraciones de una línea con lista blanca de
+caracteres (tessedit_char_whitelist).
+
+Este módulo solo trabaja con los datos de image_to_data; las pasadas de
+Tesseract las lanza el motor (ocr_engine.OCREngine).
+"""
+import re
+
+# Confianza media (0-100) por debajo de la cual se vuelve a leer un valor
+FIELD_MIN_CONF = 80
+
+# Etiquetas como máximo por campo (p. ej. 'factura' puede aparecer en la cabecera)
+MAX_ANCHORS_PER_FIELD = 2
+
+AMOUNT_CHARS = '0123456789.,$€'
+CODE_CHARS = '0123456789-/ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def _line_configs(whitelist):
+    return [
+        rf'--oem 1 --psm 7 -l spa -c tessedit_char_whitelist={whitelist}',  # Línea con lista blanca
+        r'--oem 1 --psm 7 -l spa',  # Línea sin restricciones
+        rf'--oem 1 --psm 13 -c tessedit_char_whitelist={whitelist}',  # Línea en bruto
+    ]
+
+
+# Campo de invoice_data -> palabras de la etiqueta y configuraciones para el valor
+FIELD_ANCHORS = {
+    'total_amount': {'keywords': ('total', 'importe'), 'configs': _line_configs(AMOUNT_CHARS)},
+    'tax': {'keywords': ('iva', 'vat'), 'configs': _line_configs(AMOUNT_CHARS + '%')},
+    'nif_cif': {'keywords': ('nit', 'nif', 'cif'), 'configs': _line_configs(CODE_CHARS)},
+    'invoice_number': {'keywords': ('factura', 'invoice', 'fact'), 'configs': _line_configs(CODE_CHARS)},
+    'date': {'keywords': ('fecha', 'date'), 'configs': _line_configs('0123456789/-.:')},
+}
+
+
+def _normalize(word):
+    return re.sub(r'[^a-z]', '', str(word).lower())
+
+
+def _words(data):
+    """Índices de las filas de palabra con texto"""
+    return [i for i in range(len(data['text'])) if data['level'][i] == 5 and str(data['text'][i]).strip()]
+
+
+def _line_key(data, i):
+    return data['page_num'][i], data['block_num'][i], data['par_num'][i], data['line_num'][i]
+
+
+def _mean_conf(data, indices):
+    confs = [float(data['conf'][i]) for i in indices if float(data['conf'][i]) >= 0]
+    return sum(confs) / len(confs) if confs else 0.0
+
+
+def find_anchors(data):
+    """
+    Etiquetas de campo encontradas en la pasada de página completa
+
+    Devuelve una lista de diccionarios con el campo, el índice de la palabra
+    de la etiqueta, los índices de las palabras que la siguen en la misma
+    línea (el valor) y su confianza media. Como mucho una etiqueta por línea.
+    """
+    words = _words(data)
+    lines = {}
+    for i in words:
+        lines.setdefault(_line_key(data, i), []).append(i)
+
+    anchors = []
+    per_field = {}
+    seen_lines = set()
+    for i in words:
+        word = _normalize(data['text'][i])
+        for field, spec in FIELD_ANCHORS.items():
+            if word not in spec['keywords']:
+                continue
+            key = _line_key(data, i)
+            if key in seen_lines or per_field.get(field, 0) >= MAX_ANCHORS_PER_FIELD:
+                break
+            seen_lines.add(key)
+            per_field[field] = per_field.get(field, 0) + 1
+            value = [j for j in lines[key] if data['left'][j] > data['left'][i]]
+            anchors.append({
+                'field': field,
+                'anchor': i,
+                'value': value,
+                'value_conf': _mean_conf(data, value),
+            })
+            break
+    return anchors
+
+
+def needs_retry(anchor, invoice_data, min_conf=FIELD_MIN_CONF):
+    """Solo se vuelve a leer si el campo no se extrajo o su valor tiene poca confianza"""
+    return invoice_data.get(anchor['field']) is None or anchor['value_conf'] < min_conf
+
+
+def value_box(data, anchor, image_shape):
+    """
+    Caja del valor: desde el final de la etiqueta hasta el borde derecho de
+    la página, con la altura de la línea y algo de margen
+    """
+    i = anchor['anchor']
+    rows = [i] + anchor['value']
+    top = min(data['top'][j] for j in rows)
+    bottom = max(data['top'][j] + data['height'][j] for j in rows)
+    margin = max(2, (bottom - top) // 3)
+    x0 = data['left'][i] + data['width'][i]
+    y0 = max(0, top - margin)
+    y1 = min(image_shape[0], bottom + margin)
+    return x0, y0, max(1, image_shape[1] - x0), max(1, y1 - y0)
+
+
+def best_reading(readings):
+    """La lectura (config, datos) cuyas palabras tienen más confianza media"""
+    best = None
+    for config, data in readings:
+        indices = _words(data)
+        if not indices:
+            continue
+        conf = _mean_conf(data, indices)
+        if best is None or conf > best[2]:
+            best = (config, data, conf)
+    return best
+
+
+def patch_value(data, anchor, reading, box):
+    """
+    Sustituye las palabras del valor en `data` por las de la nueva lectura
+    (trasladadas a la página y colocadas en la línea de la etiqueta)
+    """
+    x0, y0 = box[:2]
+    i = anchor['anchor']
+    new_rows = []
+    for word_num, j in enumerate(_words(reading), data['word_num'][i] + 1):
+        row = {column: reading[column][j] for column in data}
+        row.update({
+            'page_num': data['page_num'][i],
+            'block_num': data['block_num'][i],
+            'par_num': data['par_num'][i],
+            'line_num': data['line_num'][i],
+            'word_num': word_num,
+            'left': reading['left'][j] + x0,
+            'top': reading['top'][j] + y0,
+        })
+        new_rows.append(row)
+
+    removed = set(anchor['value'])
+    insert_at = (max(anchor['value']) if anchor['value'] else i) + 1
+    patched = {column: [] for column in data}
+    for k in range(len(data['text'])):
+        if k == insert_at:
+            for row in new_rows:
+                for column in patched:
+                    patched[column].append(row[column])
+        if k not in removed:
+            for column in patched:
+                patched[column].append(data[column][k])
+    if insert_at >= len(data['text']):
+        for row in new_rows:
+            for column in patched:
+                patched[column].append(row[column])
+    return patched
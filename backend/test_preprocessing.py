@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Pruebas de regresión del preprocesamiento (sin servidor ni Tesseract)
+
+Se ejecutan con `python test_preprocessing.py` o con pytest.
+"""
+import sys
+
+import cv2
+import numpy as np
+
+from preprocessing import detect_orientation, estimate_skew
+
+# Inclinaciones (grados, positivo = el texto baja hacia la derecha) y error admitido
+SKEW_ANGLES = (-6, -4, -3, -2, 2, 3, 4, 6)
+SKEW_TOLERANCE = 0.5
+
+# Tamaño de letra y separación entre líneas (px) de las páginas de orientación:
+# del texto casi pegado al muy espaciado
+ORIENTATION_LAYOUTS = [(scale, spacing) for scale in (0.8, 1.0) for spacing in (25, 30, 40, 50, 60, 70)]
+
+# Giro que devuelve detect_orientation (sentido horario) -> giro que lo provoca
+UNDO_ROTATION = {90: cv2.ROTATE_90_COUNTERCLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_CLOCKWISE}
+
+
+def synthetic_page(width=1240, height=1753, scale=1.1, spacing=70):
+    """Página A4 a 150 ppp con líneas de texto de factura"""
+    page = np.full((height, width), 255, np.uint8)
+    lines = [
+        'Comercial Ejemplo SA', 'NIF: B12345678', 'FACTURA No: F-2024-00123', 'Fecha: 14/10/2024',
+        'Cliente: Pedro Ramirez', '2 x Tornillos x100      319,10', '1 x Pintura blanca 1 galon   1.247,96',
+        '1 x Caja de carton       128,02', 'Subtotal: 1.695,08', 'IVA 19%: 322,07', 'TOTAL: 2.017,15',
+    ]
+    for i, text in enumerate(lines):
+        cv2.putText(page, text, (100, 160 + i * spacing), cv2.FONT_HERSHEY_SIMPLEX, scale, 0, 2, cv2.LINE_AA)
+    return page
+
+
+def skewed(page, angle):
+    """Inclina la página `angle` grados (positivo = el texto baja hacia la derecha)"""
+    h, w = page.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), -angle, 1.0)
+    return cv2.warpAffine(page, matrix, (w, h), borderValue=255)
+
+
+def test_estimate_skew_straight_page():
+    """Una página recta no se gira"""
+    assert abs(estimate_skew({}, synthetic_page())) <= SKEW_TOLERANCE
+
+
+def test_estimate_skew_recovers_angle():
+    """La inclinación de una página girada entre ±2 y ±6 grados se recupera"""
+    page = synthetic_page()
+    for angle in SKEW_ANGLES:
+        info = {}
+        estimated = estimate_skew(info, skewed(page, angle))
+        assert abs(estimated - angle) <= SKEW_TOLERANCE, f'{angle}°: estimado {estimated:.2f}°'
+        assert info['skew_angle'] == round(estimated, 2)
+
+
+def test_detect_orientation_upright_pages():
+    """Una página derecha no se gira, esté el texto junto o espaciado"""
+    for scale, spacing in ORIENTATION_LAYOUTS:
+        rotation, info = detect_orientation(synthetic_page(scale=scale, spacing=spacing))
+        assert rotation == 0, f'letra {scale}, líneas cada {spacing} px: giro {rotation} ({info})'
+
+
+def test_detect_orientation_rotated_pages():
+    """Las páginas de lado o boca abajo se detectan con cualquier interlineado"""
+    for scale, spacing in ORIENTATION_LAYOUTS:
+        page = synthetic_page(scale=scale, spacing=spacing)
+        for expected, undo in UNDO_ROTATION.items():
+            rotation, info = detect_orientation(cv2.rotate(page, undo))
+            assert rotation == expected, (
+                f'letra {scale}, líneas cada {spacing} px, girada {expected}: giro {rotation} ({info})'
+            )
+
+
+def main():
+    tests = [
+        test_estimate_skew_straight_page, test_estimate_skew_recovers_angle,
+        test_detect_orientation_upright_pages, test_detect_orientation_rotated_pages,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)